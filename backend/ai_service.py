@@ -1,223 +1,704 @@
 import requests
-import json
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+import os
+import logging
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
+import math
 import re
+from utils import json_loads, json_dumps
+
+logger = logging.getLogger(__name__)
+
+# How much of an email body each prompt sees. Slicing a str copies only the
+# prefix, so truncating up front keeps every later step (cache keys, prompt
+# formatting, the request body) proportional to these limits, not the email
+_RELEVANCE_BODY_CHARS = 500
+_BATCH_BODY_CHARS = 300
+_SUMMARY_BODY_CHARS = 4000
+_REPLY_BODY_CHARS = 800
+
+# Prompts are module constants and the variable text always comes last, so
+# Ollama can reuse the cached prefix across calls instead of re-evaluating it
+_RELEVANCE_SYSTEM_PROMPT = """You are an email relevance classifier. You should be VERY CONSERVATIVE about marking emails as not relevant.
+
+Mark as NOT_RELEVANT ONLY if the email is clearly:
+- Obvious spam (Nigerian prince, lottery winnings, etc.)
+- Mass marketing campaigns with unsubscribe links
+- Automated promotional emails from retailers
+- Clear phishing attempts
+- Newsletter subscriptions that are clearly promotional
+
+Mark as RELEVANT if the email contains:
+- Any personal communication (even if brief)
+- Work-related content (interviews, leave requests, project updates)
+- Important notifications (password changes, account updates)
+- Meeting invitations or scheduling
+- Any form of direct communication between people
+- Client or customer communications
+- Service notifications from legitimate companies
+- Any email that might require a response
+
+When in doubt, always choose RELEVANT. It's better to include an email than to miss something important.
+
+IMPORTANT: Respond with ONLY one word: either 'RELEVANT' or 'NOT_RELEVANT'. Do not provide explanations or additional text."""
+
+_RELEVANCE_PROMPT = """Email Subject: {subject}
+
+Email Content (first 500 chars): {body}
+
+Classification:"""
+
+_BATCH_RELEVANCE_SYSTEM_PROMPT = """You are an email relevance classifier. Be VERY CONSERVATIVE about marking emails as not relevant.
+
+Use NOT_RELEVANT ONLY for obvious spam, mass marketing, retailer promotions, phishing or promotional newsletters.
+Use RELEVANT for personal or work communication, meetings, account or service notifications, and anything that might need a response.
+When in doubt, choose RELEVANT.
+
+IMPORTANT: Respond with ONLY a JSON array of labels, one per email, in order. Each label is either "RELEVANT" or "NOT_RELEVANT"."""
+
+_BATCH_RELEVANCE_PROMPT = """Classify each of these {count} emails:
+
+{entries}
+
+Labels:"""
+
+_SUMMARY_SYSTEM_PROMPT = """You are an expert email summarizer. Create concise bullet-point summaries.
+
+Guidelines:
+- Use 1-3 bullet points maximum
+- Focus on key information and action items
+- Use simple, natural language
+- Highlight deadlines or requests
+- Mention if response is needed
+- Keep each point to 1 short sentence"""
+
+_SUMMARY_PROMPT = """Subject: {subject}
+
+Email Content: {body}
+
+Please provide a bullet-point summary:"""
+
+_REPLY_SYSTEM_PROMPT = """You are an email assistant helping to draft professional replies. Read the email carefully and understand the context before responding.
+
+Guidelines:
+- Write as if you are the recipient responding directly 
+- Be concise (1-2 sentences maximum)
+- Use a natural, conversational tone
+- Address the main point of the email appropriately
+- If someone is sharing information with you, acknowledge it appropriately
+- If someone is asking a question, answer it directly
+- If it's a status update or FYI, acknowledge receipt and thank them
+- Use appropriate greetings (Hi [Name of sender]) and professional closings
+- Do NOT respond as if you are the sender of the original email
+- Use Regards name as Aditya Mishra as he is the owner of this mail also keep this mind while responding that this mail is received to Aditya Mishra
+
+Important: Understand who is writing to whom and respond accordingly."""
+
+_REPLY_PROMPT = """Original Email Subject: {subject}
+
+Original Email Content: {body}
+{context}
+
+Please write a professional and appropriate reply. Remember to respond as the recipient of this email:"""
+
+_ENHANCE_SYSTEM_PROMPT = """Help improve an email reply. Make it more natural and professional while keeping the core message."""
+
+_ENHANCE_PROMPT = """Original Reply: {reply}
+
+Additional Context: {context}
+
+
+Please improve this reply:"""
+
+# Greeting must appear in the first 50 chars of a reply, closing in the last 100
+_GREETING_RE = re.compile(r'hi|hello|dear|thank you', re.IGNORECASE)
+_CLOSING_RE = re.compile(r'regards|best|thanks|sincerely', re.IGNORECASE)
+
+# Model artifacts stripped from replies, mapped to their replacement; one pass handles them all
+_REPLY_ARTIFACTS = {"Subject:": "", "Dear recipient": "Hi"}
+_ARTIFACT_RE = re.compile('|'.join(map(re.escape, _REPLY_ARTIFACTS)))
+
+# Summary clean-up: collapse blank lines and surrounding whitespace, then bullet every line
+_LINE_BREAK_RE = re.compile(r'\s*\n\s*')
+_MISSING_BULLET_RE = re.compile(r'^(?![•-])', re.MULTILINE)
+
+# Relevance label: the model's answer only matters if it says NOT_RELEVANT
+_NOT_RELEVANT_RE = re.compile(r'NOT[_ ]RELEVANT', re.IGNORECASE)
+
+# Exemplars for the embedding classifier; each group is averaged into one centroid
+_RELEVANT_EXAMPLES = [
+    "Can we move our meeting to Thursday afternoon? Let me know what works for you.",
+    "Hi, please find attached the project update for this week. Let me know if you have questions.",
+    "Interview invitation: we would like to schedule a call with you next Tuesday.",
+    "I will be on leave from Monday to Wednesday, please approve my leave request.",
+    "Your password was changed successfully. If this wasn't you, contact support immediately.",
+    "Reminder: the client proposal is due by Friday end of day.",
+    "Thanks for your help yesterday, could you review the attached document?",
+    "Your invoice for this month is attached, payment is due in 15 days.",
+    "Security alert: a new sign-in to your account was detected.",
+    "Following up on our discussion, here are the next steps for the contract.",
+    "Quick question about the deployment, are we still on track for the release?",
+    "Meeting invitation: quarterly planning review, conference room B, 10am.",
+    "Your order has shipped and will arrive on Wednesday. Track your package here.",
+    "Hi team, the build is failing on main, can someone take a look?",
+    "Your verification code is 482913. It expires in 10 minutes.",
+]
+
+_NOT_RELEVANT_EXAMPLES = [
+    "Congratulations! You have won a $1000 gift card. Click here to claim your prize now.",
+    "Huge summer sale: 50% off everything, shop now before the offer expires. Unsubscribe here.",
+    "Make money fast working from home, no experience needed, act now!",
+    "Dear friend, I am a prince and need your help transferring 10 million dollars.",
+    "Limited time offer: buy one get one free on all items this weekend only.",
+    "Your weekly newsletter: top 10 deals you can't miss. To stop receiving these emails click here.",
+    "You have been selected for an exclusive offer, call now to claim your reward.",
+    "Flash sale ends tonight! Free shipping on orders over $50. Shop the collection.",
+    "Verify your account immediately or it will be suspended, click this link to login.",
+    "New arrivals just for you: browse our latest collection and save 20% today.",
+    "Get rich quick with this one simple trick, no obligation, order now.",
+    "You received this promotional email because you subscribed to our marketing list.",
+    "Hot singles in your area are waiting to meet you, click here.",
+    "Final notice: claim your free cruise vacation before it's too late.",
+    "Exclusive discount code inside! Don't miss our biggest sale of the year.",
+]
+
+def _cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _centroid(vectors: List[List[float]]) -> List[float]:
+    return [sum(values) / len(vectors) for values in zip(*vectors)]
+
+# nomic-embed-text is trained with task prefixes; exemplars and emails must share the same one
+_EMBED_TASK_PREFIX = "classification: "
+
+class RelevanceClassifier:
+    """Nearest-centroid relevance classifier over Ollama embeddings"""
+    
+    def __init__(self, service: 'OllamaService', model: str = "nomic-embed-text",
+                 relevant_margin: float = 0.05, not_relevant_margin: float = 0.15):
+        self.service = service
+        self.model = model
+        # Dropping an email loses it for good, so NOT_RELEVANT needs a much clearer lead than
+        # RELEVANT; anything closer goes to the language model ("when in doubt, RELEVANT")
+        self.relevant_margin = relevant_margin
+        self.not_relevant_margin = not_relevant_margin
+        self.batch_size = 32
+        self._centroids = None
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embed texts with one /api/embed call per batch"""
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = [_EMBED_TASK_PREFIX + text for text in texts[i:i + self.batch_size]]
+            response = self.service._post("embed", {"model": self.model, "input": batch, "keep_alive": "30m"})
+            if response.status_code != 200:
+                return None
+            embeddings.extend(json_loads(response.content).get('embeddings', []))
+        return embeddings if len(embeddings) == len(texts) else None
+    
+    def _ensure_centroids(self) -> bool:
+        """Embed the exemplars once; back off for a while if the embedding model is missing"""
+        with self._lock:
+            if self._centroids is not None:
+                return True
+            if time.monotonic() < self._unavailable_until:
+                return False
+            
+            try:
+                vectors = self._embed(_RELEVANT_EXAMPLES + _NOT_RELEVANT_EXAMPLES)
+            except Exception as e:
+                logger.warning("Embedding classifier unavailable: %s", e)
+                vectors = None
+            
+            if not vectors:
+                self._unavailable_until = time.monotonic() + 300
+                return False
+            
+            split = len(_RELEVANT_EXAMPLES)
+            self._centroids = (_centroid(vectors[:split]), _centroid(vectors[split:]))
+            return True
+    
+    def classify(self, texts: List[str]) -> List[Optional[bool]]:
+        """Label each text, or None where the lead is too small to call"""
+        if not texts or not self._ensure_centroids():
+            return [None] * len(texts)
+        
+        try:
+            vectors = self._embed(texts)
+        except Exception as e:
+            logger.error("Embedding request failed: %s", e)
+            vectors = None
+        if not vectors:
+            return [None] * len(texts)
+        
+        relevant_centroid, not_relevant_centroid = self._centroids
+        labels = []
+        for vector in vectors:
+            relevant = _cosine_similarity(vector, relevant_centroid)
+            not_relevant = _cosine_similarity(vector, not_relevant_centroid)
+            if relevant - not_relevant >= self.relevant_margin:
+                labels.append(True)
+            elif not_relevant - relevant >= self.not_relevant_margin:
+                labels.append(False)
+            else:
+                labels.append(None)
+        return labels
+
+class ResponseCache:
+    """Thread-safe LRU cache for model responses keyed on normalized email text"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(operation: str, subject: str, body: str) -> Tuple[str, str]:
+        """Fold case and whitespace so re-sent copies of the same email share an entry"""
+        text = ' '.join(f"{subject}\n{body}".split()).casefold()
+        return operation, text
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+# Generation priorities, lowest served first: classification gates the rest of a sync,
+# and a summary is needed before an email can be shown; ties are served in arrival order
+_PRIORITY_CLASSIFY = 0
+_PRIORITY_SUMMARY = 1
+_PRIORITY_REPLY = 2
+
+# Sampling options every generate call starts from; never mutated
+_DEFAULT_OPTIONS = {
+    "temperature": 0.3,  # Lower temperature for more consistent classification
+    "top_p": 0.9,
+    "num_predict": 500,
+    "num_ctx": 4096
+}
 
 class OllamaService:
     """Service for interacting with Ollama local LLM"""
     
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "phi3:mini"):
+    def __init__(self, base_url: str = "http://localhost:11434", model: str = "phi3:mini",
+                 embed_model: str = "nomic-embed-text"):
         self.base_url = base_url
         self.model = model
         self.api_url = f"{base_url}/api"
+        # Match the server's OLLAMA_NUM_PARALLEL so batched calls overlap without queueing
+        self.max_parallel = int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+        # Emails marshaled into one classification prompt; larger batches degrade accuracy
+        self.batch_size = 8
+        
+        # Reuse connections to the local server instead of reconnecting per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(10, self.max_parallel), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Pinned explicitly so a compressing proxy in front of a remote Ollama can gzip
+        # long generations; requests decompresses transparently
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        # (connect, read): fail fast when the server is down, but let long generations finish
+        self.timeout = (10, 120)
+        self._cache = ResponseCache()
+        # Only subject + first 500 chars reach the classifier, so this key space is small
+        self._relevance_cache = ResponseCache(maxsize=4096, ttl=86400)
+        # Cached check_health result; status endpoints poll far more often than it changes
+        self.health_ttl = 30
+        self._health = None
+        self._health_checked_at = 0.0
+        # Embedding lookups settle clear-cut emails without running the generator
+        self.relevance_classifier = RelevanceClassifier(self, embed_model)
+        # Generation slots: never have more requests in flight than the server runs in parallel,
+        # so extra callers wait here instead of piling up in Ollama's queue. Waiters queue on
+        # (priority, arrival ticket) and the head of the queue takes the next free slot
+        self._stats_lock = threading.Lock()
+        self._slot_free = threading.Condition(self._stats_lock)
+        self._slot_queue = []
+        self._tickets = itertools.count()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=200)
+    
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def check_health(self) -> bool:
-        """Check if Ollama service is running and model is available"""
+        """Check if Ollama service is running and model is available, reusing a recent result"""
+        if self._health is not None and time.monotonic() - self._health_checked_at < self.health_ttl:
+            return self._health
+        
+        was_healthy = self._health
+        healthy = self._fetch_health()
+        self._health, self._health_checked_at = healthy, time.monotonic()
+        if healthy and not was_healthy:
+            # Load the weights now so the first real request doesn't pay for it
+            threading.Thread(target=self.warm_up, daemon=True).start()
+        return healthy
+    
+    def warm_up(self):
+        """Load the model into memory and keep it resident"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            # An empty prompt makes Ollama load the model without generating anything
+            self._post("generate", {"model": self.model, "prompt": "", "keep_alive": "30m"})
+        except Exception as e:
+            logger.warning("Ollama warm-up failed: %s", e)
+    
+    def _invalidate_health(self):
+        """Force the next check_health call to hit the server"""
+        self._health = None
+    
+    def _fetch_health(self) -> bool:
+        """Query the server's model list"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
             if response.status_code != 200:
                 return False
             
-            models = response.json().get('models', [])
+            models = json_loads(response.content).get('models', [])
             model_names = [model['name'] for model in models]
             
             return any(self.model in name for name in model_names)
         except Exception as e:
-            print(f"Ollama health check failed: {str(e)}")
+            logger.error("Ollama health check failed: %s", e)
             return False
     
-    def _make_request(self, prompt: str, system_prompt: str = "") -> Optional[str]:
+    @contextmanager
+    def _generation_slot(self, priority: int = _PRIORITY_REPLY):
+        """Hold one of the max_parallel generation slots, recording queueing and latency"""
+        ticket = (priority, next(self._tickets))
+        with self._slot_free:
+            heapq.heappush(self._slot_queue, ticket)
+            self._slot_free.wait_for(
+                lambda: self._in_flight < self.max_parallel and self._slot_queue[0] == ticket
+            )
+            heapq.heappop(self._slot_queue)
+            self._in_flight += 1
+            # Another slot may still be free for the next caller in line
+            self._slot_free.notify_all()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._slot_free:
+                self._in_flight -= 1
+                self._latencies.append(time.monotonic() - started)
+                self._slot_free.notify_all()
+    
+    def get_load_stats(self) -> Dict:
+        """Snapshot of generation queueing and recent request latency"""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {'waiting': len(self._slot_queue), 'in_flight': self._in_flight, 'max_parallel': self.max_parallel}
+        if latencies:
+            stats['p50_seconds'] = round(latencies[len(latencies) // 2], 3)
+            stats['p99_seconds'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3)
+        return stats
+    
+    def _post(self, endpoint: str, payload: Dict, **kwargs) -> requests.Response:
+        """POST a JSON body to an Ollama API endpoint"""
+        return self.session.post(
+            f"{self.api_url}/{endpoint}",
+            data=json_dumps(payload),
+            headers={'Content-Type': 'application/json'},
+            timeout=self.timeout,
+            **kwargs
+        )
+    
+    def _build_payload(self, prompt: str, system_prompt: str, stream: bool,
+                       options: Optional[Dict] = None, response_format: Optional[str] = None) -> Dict:
+        """Build the /api/generate request body"""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "system": system_prompt,
+            "stream": stream,
+            # Keep the model and its prompt cache resident between calls
+            "keep_alive": "30m",
+            # Shared default dict; only calls that override something pay for a merged copy
+            "options": {**_DEFAULT_OPTIONS, **options} if options else _DEFAULT_OPTIONS
+        }
+        if response_format:
+            payload["format"] = response_format
+        return payload
+    
+    def _make_request(self, prompt: str, system_prompt: str = "", options: Optional[Dict] = None,
+                      response_format: Optional[str] = None, priority: int = _PRIORITY_REPLY) -> Optional[str]:
         """Make request to Ollama API"""
         try:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "system": system_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,  # Lower temperature for more consistent classification
-                    "top_p": 0.9,
-                    "max_tokens": 500
-                }
-            }
+            payload = self._build_payload(prompt, system_prompt, False, options, response_format)
             
-            response = requests.post(
-                f"{self.api_url}/generate",
-                json=payload,
-                timeout=30
-            )
+            with self._generation_slot(priority):
+                response = self._post("generate", payload)
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 return result.get('response', '').strip()
+            if response.status_code >= 500:
+                self._invalidate_health()
         except Exception as e:
-            print(f"Error making Ollama request: {str(e)}")
+            logger.error("Error making Ollama request: %s", e)
         
         return None
     
+    def _make_request_stream(self, prompt: str, system_prompt: str = "",
+                             priority: int = _PRIORITY_REPLY) -> Iterator[str]:
+        """Make a streaming request to Ollama API, yielding text as it is generated"""
+        # Only replies stream: the modal shows them as they are written. Summaries are made
+        # during sync and stored before anyone reads them, so they stay on _make_request
+        try:
+            payload = self._build_payload(prompt, system_prompt, True)
+            
+            # The slot is held until the stream finishes, since the server is busy until then
+            with self._generation_slot(priority), self._post("generate", payload, stream=True) as response:
+                if response.status_code != 200:
+                    logger.error("Ollama stream request failed: %s", response.status_code)
+                    if response.status_code >= 500:
+                        self._invalidate_health()
+                    return
+                
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json_loads(line)
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        break
+        except Exception as e:
+            logger.error("Error streaming Ollama request: %s", e)
+    
     def check_email_relevance(self, email_body: str, subject: str) -> bool:
         """Check if email is relevant (not spam, ads, or irrelevant content)"""
-        system_prompt = """You are an email relevance classifier. You should be VERY CONSERVATIVE about marking emails as not relevant.
-
-        Mark as NOT_RELEVANT ONLY if the email is clearly:
-        - Obvious spam (Nigerian prince, lottery winnings, etc.)
-        - Mass marketing campaigns with unsubscribe links
-        - Automated promotional emails from retailers
-        - Clear phishing attempts
-        - Newsletter subscriptions that are clearly promotional
-
-        Mark as RELEVANT if the email contains:
-        - Any personal communication (even if brief)
-        - Work-related content (interviews, leave requests, project updates)
-        - Important notifications (password changes, account updates)
-        - Meeting invitations or scheduling
-        - Any form of direct communication between people
-        - Client or customer communications
-        - Service notifications from legitimate companies
-        - Any email that might require a response
-
-        When in doubt, always choose RELEVANT. It's better to include an email than to miss something important.
-
-        IMPORTANT: Respond with ONLY one word: either 'RELEVANT' or 'NOT_RELEVANT'. Do not provide explanations or additional text."""
-        
-        prompt = f"""
-        Email Subject: {subject}
+        return self._classify_relevance(subject, email_body[:_RELEVANCE_BODY_CHARS])
+    
+    def _classify_relevance(self, subject: str, body_prefix: str) -> bool:
+        """Classify a subject and truncated body, trying the cache and embeddings before the LLM"""
+        cache_key = ResponseCache.make_key('relevance', subject, body_prefix)
+        cached = self._relevance_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        Email Content (first 500 chars): {email_body[:500]}
+        label = self.relevance_classifier.classify([f"{subject}\n{body_prefix}"])[0]
+        if label is not None:
+            self._relevance_cache.set(cache_key, label)
+            return label
         
-        Classification:"""
+        return self._generate_relevance(subject, body_prefix)
+    
+    def _generate_relevance(self, subject: str, body_prefix: str) -> bool:
+        """Ask the language model for a relevance label"""
+        cache_key = ResponseCache.make_key('relevance', subject, body_prefix)
+        prompt = _RELEVANCE_PROMPT.format(subject=subject, body=body_prefix)
         
-        response = self._make_request(prompt, system_prompt)
+        # Deterministic sampling so a cached label is the same one a fresh call would give.
+        # The answer is a single label, so stop generating as soon as it is out
+        response = self._make_request(prompt, _RELEVANCE_SYSTEM_PROMPT,
+                                      {"temperature": 0, "num_predict": 8, "stop": ["\n"]},
+                                      priority=_PRIORITY_CLASSIFY)
         
         if response:
-            # Clean the response to extract just the classification
-            response_clean = response.upper().strip()
-            
-            # Look for RELEVANT or NOT_RELEVANT in the response
-            if 'NOT_RELEVANT' in response_clean or 'NOT RELEVANT' in response_clean:
+            # Anything but an explicit NOT_RELEVANT, including an unclear answer,
+            # counts as relevant, so a single case-insensitive search decides the label
+            if _NOT_RELEVANT_RE.search(response):
                 classification = 'NOT_RELEVANT'
-            elif 'RELEVANT' in response_clean:
-                classification = 'RELEVANT'
             else:
-                # If unclear, default to relevant
                 classification = 'RELEVANT'
                 
-            print(f"[DEBUG] AI Classification for '{subject[:30]}...': {classification}")
-            return classification == 'RELEVANT'
+            logger.debug("AI Classification for '%.30s...': %s", subject, classification)
+            is_relevant = classification == 'RELEVANT'
+            self._relevance_cache.set(cache_key, is_relevant)
+            return is_relevant
         
         # If AI fails, default to relevant (conservative approach)
-        print(f"[DEBUG] AI classification failed for '{subject[:30]}...', defaulting to RELEVANT")
+        logger.debug("AI classification failed for '%.30s...', defaulting to RELEVANT", subject)
         return True
     
-    def summarize_email(self, email_body: str, subject: str) -> str:
-        """Generate a concise, human-like summary of the email"""
-        system_prompt = """You are an expert email summarizer. Create concise bullet-point summaries.
-
-        Guidelines:
-        - Use 1-3 bullet points maximum
-        - Focus on key information and action items
-        - Use simple, natural language
-        - Highlight deadlines or requests
-        - Mention if response is needed
-        - Keep each point to 1 short sentence"""
+    def classify_batch(self, emails: List[Tuple[str, str]]) -> List[bool]:
+        """Check relevance for several (email_body, subject) pairs, several emails per prompt"""
+        results = [None] * len(emails)
+        pending = []
+        for index, (email_body, subject) in enumerate(emails):
+            body_prefix = email_body[:_RELEVANCE_BODY_CHARS]
+            cached = self._relevance_cache.get(ResponseCache.make_key('relevance', subject, body_prefix))
+            if cached is None:
+                pending.append((index, subject, body_prefix))
+            else:
+                results[index] = cached
         
-        prompt = f"""
-        Subject: {subject}
+        if pending:
+            labels = self.relevance_classifier.classify([f"{subject}\n{body_prefix}" for _, subject, body_prefix in pending])
+            undecided = []
+            for item, label in zip(pending, labels):
+                index, subject, body_prefix = item
+                if label is None:
+                    undecided.append(item)
+                else:
+                    results[index] = label
+                    self._relevance_cache.set(ResponseCache.make_key('relevance', subject, body_prefix), label)
+            pending = undecided
         
-        Email Content: {email_body}
+        # Similar-length prompts finish together, so no chunk is held up by one long email
+        pending.sort(key=lambda item: len(item[2]))
+        chunks = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        if chunks:
+            workers = min(self.max_parallel, len(chunks))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for chunk, labels in zip(chunks, pool.map(self._classify_chunk, chunks)):
+                    for (index, _, _), is_relevant in zip(chunk, labels):
+                        results[index] = is_relevant
         
-        Please provide a bullet-point summary:"""
+        return results
+    
+    def _classify_chunk(self, chunk: List[Tuple[int, str, str]]) -> List[bool]:
+        """Classify a group of emails with one prompt, falling back to one call per email"""
+        if len(chunk) == 1:
+            _, subject, body_prefix = chunk[0]
+            return [self._generate_relevance(subject, body_prefix)]
+        
+        entries = "\n\n".join(
+            f"{number}. Subject: {subject}\nBody: {body_prefix[:_BATCH_BODY_CHARS]}"
+            for number, (_, subject, body_prefix) in enumerate(chunk, 1)
+        )
+        prompt = _BATCH_RELEVANCE_PROMPT.format(count=len(chunk), entries=entries)
+        
+        response = self._make_request(prompt, _BATCH_RELEVANCE_SYSTEM_PROMPT,
+                                      {"temperature": 0, "num_predict": 16 * len(chunk)}, response_format="json",
+                                      priority=_PRIORITY_CLASSIFY)
+        labels = self._parse_batch_labels(response, len(chunk))
+        if labels is None:
+            logger.debug("Batch classification unparseable, classifying %s emails individually", len(chunk))
+            return [self._generate_relevance(subject, body_prefix) for _, subject, body_prefix in chunk]
         
-        response = self._make_request(prompt, system_prompt)
+        for (_, subject, body_prefix), is_relevant in zip(chunk, labels):
+            self._relevance_cache.set(ResponseCache.make_key('relevance', subject, body_prefix), is_relevant)
+        return labels
+    
+    @staticmethod
+    def _parse_batch_labels(response: Optional[str], count: int) -> Optional[List[bool]]:
+        """Turn a JSON label array into relevance flags, or None if it doesn't line up"""
+        try:
+            data = json_loads(response)
+        except (TypeError, ValueError):
+            return None
+        
+        # JSON mode sometimes wraps the array in an object
+        if isinstance(data, dict):
+            data = next((value for value in data.values() if isinstance(value, list)), None)
+        if not isinstance(data, list) or len(data) != count:
+            return None
+        
+        return ['NOT' not in str(label).upper() for label in data]
+    
+    def summarize_email(self, email_body: str, subject: str) -> str:
+        """Generate a concise, human-like summary of the email"""
+        email_body = email_body[:_SUMMARY_BODY_CHARS]
+        cache_key = ResponseCache.make_key('summary', subject, email_body)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        prompt = _SUMMARY_PROMPT.format(subject=subject, body=email_body)
+        # Three short bullets fit comfortably in 128 tokens
+        response = self._make_request(prompt, _SUMMARY_SYSTEM_PROMPT, {"temperature": 0, "num_predict": 128},
+                                      priority=_PRIORITY_SUMMARY)
         
         if response:
-            lines = response.split('\n')
-            formatted_lines = []
-            
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('•') and not line.startswith('-'):
-                    line = f"• {line}"
-                if line:
-                    formatted_lines.append(line)
-            
-            return '\n'.join(formatted_lines)
+            summary = _MISSING_BULLET_RE.sub('• ', _LINE_BREAK_RE.sub('\n', response.strip()))
+            self._cache.set(cache_key, summary)
+            return summary
         
         return f"• Email from {subject} - content review needed"
     
-    def generate_reply(self, email_body: str, subject: str, context: List[Dict] = None) -> str:
-        """Generate a professional, human-like reply to the email"""
-        system_prompt = """You are an email assistant helping to draft professional replies. Read the email carefully and understand the context before responding.
-
-        Guidelines:
-        - Write as if you are the recipient responding directly 
-        - Be concise (1-2 sentences maximum)
-        - Use a natural, conversational tone
-        - Address the main point of the email appropriately
-        - If someone is sharing information with you, acknowledge it appropriately
-        - If someone is asking a question, answer it directly
-        - If it's a status update or FYI, acknowledge receipt and thank them
-        - Use appropriate greetings (Hi [Name of sender]) and professional closings
-        - Do NOT respond as if you are the sender of the original email
-        - Use Regards name as Aditya Mishra as he is the owner of this mail also keep this mind while responding that this mail is received to Aditya Mishra
-
-        Important: Understand who is writing to whom and respond accordingly."""
-        
-        # Extract sender name from context or subject for personalization
-        sender_name = "there"
+    @staticmethod
+    def _reply_sender_name(context: List[Dict] = None) -> str:
+        """Name used in the greeting, taken from the first message's sender address"""
         if context and len(context) > 0:
             sender_email = context[0].get('sender', '')
             if '@' in sender_email:
-                sender_name = sender_email.split('@')[0].title()
-        
+                return sender_email.split('@')[0].title()
+        return "there"
+    
+    def _build_reply_prompt(self, email_body: str, subject: str, context: List[Dict] = None) -> str:
+        """Build the reply prompt, with earlier messages in the thread as context"""
         context_str = ""
         if context and len(context) > 1:
             context_str = "\n\nConversation Context (previous messages):\n"
             for i, msg in enumerate(context[:-1]):
                 context_str += f"{i+1}. From {msg['sender']}: {msg['body'][:100]}...\n"
         
-        prompt = f"""
-        Original Email Subject: {subject}
+        return _REPLY_PROMPT.format(subject=subject, body=email_body[:_REPLY_BODY_CHARS], context=context_str)
+    
+    def finish_reply(self, response: Optional[str], context: List[Dict] = None) -> str:
+        """Turn raw model output into a draft with a greeting and closing"""
+        if not response or not response.strip():
+            return "Thank you for your email. I'll review this and get back to you soon.\n\nBest regards"
         
-        Original Email Content: {email_body[:800]}
-        {context_str}
+        reply = response.strip()
+        sender_name = self._reply_sender_name(context)
         
-        Please write a professional and appropriate reply. Remember to respond as the recipient of this email:"""
+        # Clean up any AI artifacts
+        reply = _ARTIFACT_RE.sub(lambda match: _REPLY_ARTIFACTS[match.group()], reply)
         
-        response = self._make_request(prompt, system_prompt)
+        # Add appropriate greeting if not present
+        if not _GREETING_RE.search(reply, 0, 50):
+            if sender_name and sender_name != "there":
+                reply = f"Hi {sender_name},\n\n{reply}"
+            else:
+                reply = f"Hi,\n\n{reply}"
         
-        if response:
-            reply = response.strip()
-            
-            # Clean up any AI artifacts
-            reply = reply.replace("Subject:", "").replace("Dear recipient", "Hi")
-            
-            # Add appropriate greeting if not present
-            if not any(greeting in reply.lower()[:50] for greeting in ['hi', 'hello', 'dear', 'thank you']):
-                if sender_name and sender_name != "there":
-                    reply = f"Hi {sender_name},\n\n{reply}"
-                else:
-                    reply = f"Hi,\n\n{reply}"
-            
-            # Add closing if not present
-            if not any(closing in reply.lower()[-100:] for closing in ['regards', 'best', 'thanks', 'sincerely']):
-                reply = f"{reply}\n\nBest regards"
-            
-            return reply
+        # Add closing if not present
+        if not _CLOSING_RE.search(reply, max(0, len(reply) - 100)):
+            reply = f"{reply}\n\nBest regards"
         
-        return "Thank you for your email. I'll review this and get back to you soon.\n\nBest regards"
+        return reply
+    
+    def generate_reply(self, email_body: str, subject: str, context: List[Dict] = None) -> str:
+        """Generate a professional, human-like reply to the email"""
+        prompt = self._build_reply_prompt(email_body, subject, context)
+        return self.finish_reply(self._make_request(prompt, _REPLY_SYSTEM_PROMPT), context)
+    
+    def generate_reply_stream(self, email_body: str, subject: str, context: List[Dict] = None) -> Iterator[str]:
+        """Stream the raw reply text as the model produces it; pass the joined text to finish_reply"""
+        prompt = self._build_reply_prompt(email_body, subject, context)
+        yield from self._make_request_stream(prompt, _REPLY_SYSTEM_PROMPT)
     
     def enhance_reply(self, original_reply: str, additional_context: str = "") -> str:
         """Enhance or modify an existing reply"""
-        system_prompt = """Help improve an email reply. Make it more natural and professional while keeping the core message."""
-        
-        prompt = f"""
-        Original Reply: {original_reply}
-        
-        Additional Context: {additional_context}
-        
-
-        Please improve this reply:"""
+        prompt = _ENHANCE_PROMPT.format(reply=original_reply, context=additional_context)
         
-        response = self._make_request(prompt, system_prompt)
+        response = self._make_request(prompt, _ENHANCE_SYSTEM_PROMPT)
         return response if response else original_reply
\ No newline at end of file
@@ -1,102 +1,294 @@
-from flask import Flask, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, request, jsonify, session, redirect, url_for, g, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
+import atexit
 import os
 import json
+import logging
+import secrets
 import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import requests
 from email_service import OutlookEmailService
 from ai_service import OllamaService
 from models import EmailDatabase
-from utils import validate_email_relevance
+from utils import validate_email_relevance, extract_reply_content, json_loads, json_dumps, refresh_env_validation, validate_environment
+from flask.json.provider import DefaultJSONProvider
 from flask import Blueprint, jsonify, session
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
+refresh_env_validation()
+
+# Required settings: fail at startup, naming what is missing, rather than on the first login redirect
+_missing_env = [var for var, present in validate_environment().items() if not present]
+if _missing_env:
+    raise RuntimeError(
+        f"Missing required environment variables: {', '.join(_missing_env)}. Set them in the environment or .env"
+    )
+
+logger = logging.getLogger(__name__)
+
+FRONTEND_URL = os.environ['FRONTEND_URL']
+FLASK_SECRET_KEY = os.environ['FLASK_SECRET_KEY']
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify and request parsing through orjson when it is installed"""
+    
+    # orjson always writes UTF-8, so the stdlib path does too and both produce the same text
+    ensure_ascii = False
+    # Match Flask's output: sorted keys, non-str keys allowed, dates via self.default as HTTP dates
+    _ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                       if orjson is not None else 0)
+    
+    def dumps(self, obj, **kwargs):
+        # Pretty-printed debug output (indent=2) stays on the stdlib encoder
+        if orjson is None or 'indent' in kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._ORJSON_OPTIONS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return json_loads(s)
 
 app = Flask(__name__)
-app.secret_key = os.getenv('FLASK_SECRET_KEY')
-CORS(app, supports_credentials=True, origins=[os.getenv('FRONTEND_URL')])
+app.json = FastJSONProvider(app)
+app.secret_key = FLASK_SECRET_KEY
+CORS(app, supports_credentials=True, origins=[FRONTEND_URL])
 
 # Initialize services
 email_service = OutlookEmailService()
-ai_service = OllamaService()
+ai_service = OllamaService(
+    base_url=os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434'),
+    model=os.getenv('OLLAMA_MODEL', 'phi3:mini')
+)
 db = EmailDatabase()
 executor = ThreadPoolExecutor(max_workers=5)
 
-# Global variable to store active access tokens
-active_tokens = {}
+class TokenStore:
+    """Current token set, shared by request handlers and background threads"""
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tokens = {}
+    
+    def get(self, key, default=None):
+        with self._lock:
+            return self._tokens.get(key, default)
+    
+    def snapshot(self):
+        """Consistent copy of the whole token set"""
+        with self._lock:
+            return dict(self._tokens)
+    
+    def set(self, token_data, refresh_token=''):
+        """Publish a token set; refresh_token is the one it was minted from, if any"""
+        with self._lock:
+            self._tokens = {
+                'current': token_data['access_token'],
+                'refresh_token': token_data.get('refresh_token', refresh_token),
+                # Lets a session tell its own refreshed token from another user's
+                'minted_from': refresh_token or None,
+                'issued_at': time.time(),
+                'expires_in': token_data.get('expires_in', 3600)
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._tokens = {}
+
+active_tokens = TokenStore()
+TOKEN_REFRESH_BUFFER = 300
+
+# Set to run the background check now instead of waiting out the interval
+email_check_requested = threading.Event()
+# Set while someone is logged in; the checker sleeps on it instead of polling with no token
+token_ready = threading.Event()
+# Set at shutdown so background loops exit instead of finishing their wait
+shutdown_requested = threading.Event()
+EMAIL_CHECK_INTERVAL = 300
+
+# Prompt cost grows with body length; nothing past this reaches the model
+MAX_LLM_BODY_CHARS = 4000
+
+# Graph change notifications replace polling when the backend is reachable at a public HTTPS URL
+GRAPH_NOTIFICATION_URL = os.getenv('GRAPH_NOTIFICATION_URL')
+# Mail subscriptions last at most ~3 days; renew once less than a day is left
+SUBSCRIPTION_LIFETIME = timedelta(days=2)
+SUBSCRIPTION_RENEW_BEFORE = 86400
+mail_subscription = {'client_state': secrets.token_urlsafe(16)}
+
+def background_token_refresh():
+    """Background thread to refresh the access token before it expires, off the request path"""
+    while not shutdown_requested.is_set():
+        try:
+            tokens = active_tokens.snapshot()
+            refresh_token = tokens.get('refresh_token')
+            expires_at = tokens.get('issued_at', 0) + tokens.get('expires_in', 3600)
+            # Refresh one loop interval early so requests never see a token inside the buffer
+            if refresh_token and expires_at - time.time() < TOKEN_REFRESH_BUFFER + 60:
+                new_token = email_service.refresh_access_token(refresh_token)
+                if new_token:
+                    active_tokens.set(new_token, refresh_token)
+                    logger.info("Access token refreshed")
+                else:
+                    logger.error("Access token refresh failed")
+        except Exception as e:
+            logger.error("Token refresh failed: %s", e)
+        shutdown_requested.wait(60)
+
+def ensure_mail_subscription(access_token):
+    """Create or renew the new-mail subscription; False means fall back to polling"""
+    if not GRAPH_NOTIFICATION_URL:
+        return False
+    
+    subscription_id = mail_subscription.get('id')
+    expires_at = mail_subscription.get('expires_at', 0)
+    if subscription_id and expires_at - time.time() > SUBSCRIPTION_RENEW_BEFORE:
+        return True
+    
+    if subscription_id and email_service.renew_subscription(access_token, subscription_id, SUBSCRIPTION_LIFETIME):
+        logger.info("Renewed mail subscription %s", subscription_id)
+    else:
+        subscription = email_service.create_subscription(
+            access_token, GRAPH_NOTIFICATION_URL, mail_subscription['client_state'], SUBSCRIPTION_LIFETIME
+        )
+        if not subscription:
+            mail_subscription.pop('id', None)
+            return False
+        mail_subscription['id'] = subscription['id']
+        logger.info("Created mail subscription %s", subscription['id'])
+    
+    mail_subscription['expires_at'] = time.time() + SUBSCRIPTION_LIFETIME.total_seconds()
+    return True
+
+def drop_mail_subscription(access_token):
+    """Forget the new-mail subscription so the next login subscribes its own mailbox"""
+    subscription_id = mail_subscription.pop('id', None)
+    mail_subscription.pop('expires_at', None)
+    # Notifications still in flight for the old mailbox no longer match
+    mail_subscription['client_state'] = secrets.token_urlsafe(16)
+    # Best effort: an undeleted subscription expires on its own and its notifications are rejected
+    if subscription_id and access_token:
+        email_service.delete_subscription(access_token, subscription_id)
+
+def process_new_message(message_id, access_token):
+    """Fetch and process a message announced by a change notification"""
+    email = email_service.get_email_by_id(access_token, message_id)
+    # The rule filter only rejects obvious spam, so it goes first for free
+    if email and validate_email_relevance(email['body'], email['subject']):
+        email['priority'] = 'high' if 'urgent' in email['subject'].lower() else 'medium'
+        if process_email(email, access_token):
+            db.update_last_sync()
 
 def background_email_check():
-    """Background thread to check for new emails periodically"""
-    while True:
+    """Background thread to keep the mail subscription alive, or poll for new emails without one"""
+    while not shutdown_requested.is_set():
+        token_ready.wait()
+        if shutdown_requested.is_set():
+            break
         try:
             current_token = active_tokens.get('current')
-            if current_token:
-                print("[BACKGROUND] Checking for new emails...")
-                new_emails = email_service.get_new_emails_since_last_sync(current_token)
+            if current_token and not ensure_mail_subscription(current_token):
+                logger.info("Checking for new emails...")
+                # Resume the Inbox delta query where the last check (or the last run) left off
+                delta_link = db.get_sync_value('inbox_delta_link')
+                new_emails, next_link = email_service.get_new_emails_since_last_sync(current_token, delta_link)
+                if next_link and next_link != delta_link:
+                    db.set_sync_value('inbox_delta_link', next_link)
                 if new_emails:
-                    print(f"[BACKGROUND] Found {len(new_emails)} new emails")
-                    for email in new_emails:
-                        process_email(email, current_token)
+                    logger.info("Found %s new emails", len(new_emails))
+                    process_emails(new_emails, current_token)
                     db.update_last_sync()
         except Exception as e:
-            print(f"[BACKGROUND ERROR] Email check failed: {str(e)}")
-        time.sleep(300)
+            logger.error("Email check failed: %s", e)
+        email_check_requested.wait(EMAIL_CHECK_INTERVAL)
+        email_check_requested.clear()
+
+@app.route('/webhooks/graph/notifications', methods=['POST'])
+def graph_notifications():
+    """Receive Graph change notifications for new Inbox messages"""
+    # Graph validates the endpoint by POSTing a token that must be echoed back as plain text
+    validation_token = request.args.get('validationToken')
+    if validation_token:
+        return validation_token, 200, {'Content-Type': 'text/plain'}
+
+    current_token = active_tokens.get('current')
+    for notification in (request.get_json(silent=True) or {}).get('value', []):
+        if notification.get('clientState') != mail_subscription['client_state']:
+            logger.error("Ignoring notification with unexpected clientState")
+            continue
+        message_id = notification.get('resourceData', {}).get('id')
+        if message_id and current_token:
+            executor.submit(process_new_message, message_id, current_token)
+
+    # Acknowledge immediately; Graph retries anything slower than a few seconds
+    return '', 202
 
 @app.route('/auth/login')
 def login():
     """Initiate OAuth flow with Microsoft"""
     try:
         auth_url = email_service.get_auth_url()
-        print(f"[DEBUG] Generated auth URL: {auth_url}")
+        logger.debug("Generated auth URL: %s", auth_url)
         return jsonify({'auth_url': auth_url})
     except Exception as e:
-        print(f"[ERROR] Failed to generate auth URL: {str(e)}")
+        logger.error("Failed to generate auth URL: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/auth/callback')
 def auth_callback():
     """Handle OAuth callback from Microsoft"""
-    print(f"[DEBUG] Auth callback received")
+    logger.debug("Auth callback received")
     code = request.args.get('code')
     error = request.args.get('error')
 
     if error:
         error_desc = request.args.get('error_description', '')
-        print(f"[ERROR] OAuth error: {error} - {error_desc}")
-        return redirect(f"{os.getenv('FRONTEND_URL')}?auth=error&reason={error_desc}")
+        logger.error("OAuth error: %s - %s", error, error_desc)
+        return redirect(f"{FRONTEND_URL}?auth=error&reason={error_desc}")
 
     if code:
-        print(f"[DEBUG] Received auth code: {code[:10]}...")
+        logger.debug("Received auth code: %s...", code[:10])
         try:
             token_data = email_service.get_access_token(code)
             if token_data:
-                print(f"[DEBUG] Successfully obtained tokens")
+                logger.debug("Successfully obtained tokens")
                 # Store both ways for compatibility
                 session['token_data'] = token_data
                 session['access_token'] = token_data['access_token']  # Add this line
                 session['refresh_token'] = token_data.get('refresh_token', '')
                 session['token_issued_at'] = time.time()
                 session['expires_in'] = token_data.get('expires_in', 3600)
-                active_tokens['current'] = token_data['access_token']
+                active_tokens.set(token_data)
+                token_ready.set()
+                email_check_requested.set()
                 
-                print(f"[DEBUG] Session data stored: {list(session.keys())}")
-                return redirect(f"{os.getenv('FRONTEND_URL')}?auth=success")
+                logger.debug("Session data stored: %s", list(session.keys()))
+                return redirect(f"{FRONTEND_URL}?auth=success")
             else:
-                print(f"[ERROR] Failed to obtain tokens")
-                return redirect(f"{os.getenv('FRONTEND_URL')}?auth=error&reason=token_exchange_failed")
+                logger.error("Failed to obtain tokens")
+                return redirect(f"{FRONTEND_URL}?auth=error&reason=token_exchange_failed")
         except Exception as e:
-            print(f"[ERROR] Exception during token exchange: {str(e)}")
-            return redirect(f"{os.getenv('FRONTEND_URL')}?auth=error&reason=exception")
+            logger.error("Exception during token exchange: %s", e)
+            return redirect(f"{FRONTEND_URL}?auth=error&reason=exception")
 
-    return redirect(f"{os.getenv('FRONTEND_URL')}?auth=error&reason=no_code")
+    return redirect(f"{FRONTEND_URL}?auth=error&reason=no_code")
 
 def get_valid_token():
-    """Get a valid access token, refreshing if needed"""
+    """Get a valid access token, resolved at most once per request"""
+    if 'access_token' not in g:
+        g.access_token = resolve_token()
+    return g.access_token
+
+def resolve_token():
+    """Read the session's access token, refreshing if needed"""
     if 'token_data' not in session:
-        print("[DEBUG] No token_data in session")
+        logger.debug("No token_data in session")
         return None
     
     # Check if token is expired (with 5 minute buffer)
@@ -104,31 +296,46 @@ def get_valid_token():
     expires_in = session.get('expires_in', 3600)
     current_time = time.time()
     
-    print(f"[DEBUG] Token check - Issued: {issued_at}, Expires in: {expires_in}, Current: {current_time}")
+    logger.debug("Token check - Issued: %s, Expires in: %s, Current: %s", issued_at, expires_in, current_time)
     
-    if current_time - issued_at > (expires_in - 300):  # 5 minute buffer
-        print("[DEBUG] Token expired, attempting refresh")
+    if current_time - issued_at > (expires_in - TOKEN_REFRESH_BUFFER):  # 5 minute buffer
+        # The background refresher normally has a newer token ready; the store is
+        # process-wide, so only take it when minted from this session's refresh token
+        fresh = active_tokens.snapshot()
+        session_refresh_token = session.get('refresh_token')
+        if session_refresh_token and fresh.get('minted_from') == session_refresh_token and \
+                fresh.get('issued_at', 0) > issued_at and \
+                current_time - fresh['issued_at'] <= fresh['expires_in'] - TOKEN_REFRESH_BUFFER:
+            logger.debug("Using token refreshed in the background")
+            session['token_data'] = {**session['token_data'], 'access_token': fresh['current']}
+            session['access_token'] = fresh['current']
+            session['refresh_token'] = fresh['refresh_token']
+            session['token_issued_at'] = fresh['issued_at']
+            session['expires_in'] = fresh['expires_in']
+            return fresh['current']
+        
+        logger.debug("Token expired, attempting refresh")
         refresh_token = session.get('refresh_token')
         if refresh_token:
             new_token = email_service.refresh_access_token(refresh_token)
             if new_token:
-                print("[DEBUG] Token refreshed successfully")
+                logger.debug("Token refreshed successfully")
                 session['token_data'] = new_token
                 session['access_token'] = new_token['access_token']
                 session['refresh_token'] = new_token.get('refresh_token', refresh_token)
                 session['token_issued_at'] = time.time()
                 session['expires_in'] = new_token.get('expires_in', 3600)
-                active_tokens['current'] = new_token['access_token']
+                active_tokens.set(new_token, refresh_token)
                 return new_token['access_token']
             else:
-                print("[DEBUG] Token refresh failed")
+                logger.debug("Token refresh failed")
                 return None
         else:
-            print("[DEBUG] No refresh token available")
+            logger.debug("No refresh token available")
             return None
     
     access_token = session['token_data']['access_token']
-    print(f"[DEBUG] Using existing token: {access_token[:20]}...")
+    logger.debug("Using existing token: %s...", access_token[:20])
     return access_token
 
 @app.route('/api/status')
@@ -146,8 +353,8 @@ def get_status():
     ollama_status = ai_service.check_health()
     last_sync = db.get_last_sync_time()
 
-    print(f"[DEBUG] Status check - Auth: {authenticated}, Has session: {has_token_data}, Ollama: {ollama_status}")
-    print(f"[DEBUG] Session keys: {list(session.keys())}")
+    logger.debug("Status check - Auth: %s, Has session: %s, Ollama: %s", authenticated, has_token_data, ollama_status)
+    logger.debug("Session keys: %s", list(session.keys()))
 
     return jsonify({
         'authenticated': authenticated,
@@ -155,83 +362,91 @@ def get_status():
         'last_sync': last_sync
     })
 
-def process_email(email, access_token=None):
-    """Process and save a single email"""
+def process_email(email, access_token, is_relevant=None):
+    """Process and save a single email; is_relevant skips classification when already known"""
+    # Check if email already exists
+    existing = db.get_email_by_id(email['id'])
+    if existing:
+        logger.debug("Email already exists in database")
+        return existing
+
+    processed_email = analyze_email(email, access_token, is_relevant)
+    if processed_email:
+        logger.debug("Saving email to database...")
+        db.save_email(processed_email)
+    return processed_email
+
+def analyze_email(email, access_token, is_relevant=None, has_reply=None):
+    """Classify, summarize and draft a reply for a new email, without saving it; known values skip lookups"""
     try:
-        print(f"[DEBUG] Processing email: {email.get('subject', 'No subject')[:30]}...")
+        logger.debug("Processing email: %s...", email.get('subject', 'No subject')[:30])
 
-        # Check if email already exists
-        existing = db.get_email_by_id(email['id'])
-        if existing:
-            print(f"[DEBUG] Email already exists in database")
-            return existing
+        if is_relevant is False:
+            logger.debug("Email '%s...' marked as NOT RELEVANT - skipping", email['subject'][:30])
+            return None
 
-        # Skip emails sent by the current user (replies we sent)
-        try:
-            token_to_use = access_token or get_valid_token()
-            if token_to_use:
-                # Get current user's email
-                headers = {'Authorization': f'Bearer {token_to_use}'}
-                me_response = requests.get('https://graph.microsoft.com/v1.0/me', headers=headers)
-                if me_response.status_code == 200:
-                    my_email = me_response.json().get('mail', '').lower()
-                    sender_email = email.get('sender', '').lower()
-                    
-                    if sender_email == my_email:
-                        print(f"[DEBUG] Skipping email sent by current user: {sender_email}")
-                        return None
-        except Exception as e:
-            print(f"[ERROR] Failed to check sender: {str(e)}")
+        # Inbox listings only carry a short preview; the spam rules look at footers, and the
+        # summary and reply need the whole message. Callers already ran the rules on full bodies.
+        # If the full body can't be fetched, the rules still run on the preview
+        if email.get('is_preview'):
+            full_email = email_service.get_email_by_id(access_token, email['id'])
+            if full_email:
+                email = {**email, 'body': full_email['body'], 'is_preview': False}
+            if not validate_email_relevance(email['body'], email['subject']):
+                logger.debug("Email '%s...' marked as NOT RELEVANT - skipping", email['subject'][:30])
+                return None
+
+        llm_body = email['body'][:MAX_LLM_BODY_CHARS]
 
         # Check relevance
-        try:
-            is_relevant = ai_service.check_email_relevance(email['body'], email['subject'])
-            print(f"[DEBUG] AI relevance result for '{email['subject'][:30]}...': {is_relevant}")
-        except Exception as e:
-            print(f"[ERROR] AI relevance check failed, using fallback: {str(e)}")
-            is_relevant = validate_email_relevance(email['body'], email['subject'])
-            print(f"[DEBUG] Fallback relevance result for '{email['subject'][:30]}...': {is_relevant}")
+        if is_relevant is None:
+            try:
+                is_relevant = ai_service.check_email_relevance(llm_body, email['subject'])
+                logger.debug("AI relevance result for '%s...': %s", email['subject'][:30], is_relevant)
+            except Exception as e:
+                logger.error("AI relevance check failed, using fallback: %s", e)
+                is_relevant = validate_email_relevance(email['body'], email['subject'])
+                logger.debug("Fallback relevance result for '%s...': %s", email['subject'][:30], is_relevant)
 
         if not is_relevant:
-            print(f"[DEBUG] Email '{email['subject'][:30]}...' marked as NOT RELEVANT - skipping")
+            logger.debug("Email '%s...' marked as NOT RELEVANT - skipping", email['subject'][:30])
             return None
         
-        print(f"[DEBUG] Email '{email['subject'][:30]}...' marked as RELEVANT - processing")
+        logger.debug("Email '%s...' marked as RELEVANT - processing", email['subject'][:30])
 
         # Generate summary
-        print(f"[DEBUG] Generating summary...")
+        logger.debug("Generating summary...")
         try:
-            summary = ai_service.summarize_email(email['body'], email['subject'])
+            summary = ai_service.summarize_email(llm_body, email['subject'])
         except Exception as e:
-            print(f"[ERROR] Summary generation failed: {str(e)}")
+            logger.error("Summary generation failed: %s", e)
             summary = f"• Email from {email.get('sender', 'Unknown sender')}\n• Subject: {email.get('subject', 'No subject')}"
 
-        # Check reply status
-        print(f"[DEBUG] Checking reply status...")
-        has_reply = False
+        # One conversation fetch answers both "already replied?" and the reply context;
+        # a reply status checked in bulk beforehand only needs the context when there is no reply yet
+        logger.debug("Checking reply status...")
+        conversation = []
         try:
-            # Use the passed token or get from session
-            token_to_use = access_token or get_valid_token()
-            if token_to_use:
-                has_reply = email_service.check_if_replied(token_to_use, email['id'])
+            if access_token and email.get('conversation_id') and not has_reply:
+                # The /me lookup overlaps the conversation fetch instead of following it
+                my_email = email_service.get_my_email_async(access_token) if has_reply is None else None
+                conversation = email_service.get_conversation(access_token, email['conversation_id'])
+                if my_email is not None:
+                    has_reply = email_service.has_reply(conversation, email['id'], my_email.result())
         except Exception as e:
-            print(f"[ERROR] Reply check failed: {str(e)}")
+            logger.error("Reply check failed: %s", e)
+        has_reply = bool(has_reply)
 
         # Generate draft reply if needed
         draft_reply = None
         if not has_reply:
-            print(f"[DEBUG] Generating draft reply...")
+            logger.debug("Generating draft reply...")
             try:
-                token_to_use = access_token or get_valid_token()
-                context = []
-                if token_to_use:
-                    context = email_service.get_conversation_context(token_to_use, email['id'])
-                draft_reply = ai_service.generate_reply(email['body'], email['subject'], context)
+                draft_reply = ai_service.generate_reply(llm_body, email['subject'], conversation[:5])
             except Exception as e:
-                print(f"[ERROR] Reply generation failed: {str(e)}")
+                logger.error("Reply generation failed: %s", e)
                 draft_reply = "Thank you for your email. I'll review this and get back to you soon.\n\nBest regards"
 
-        # Save to database
         processed_email = {
             'id': email['id'],
             'sender': email['sender'],
@@ -246,41 +461,73 @@ def process_email(email, access_token=None):
             'conversation_id': email.get('conversation_id', ''),
             'priority': email.get('priority', 'medium')
         }
-
-        print(f"[DEBUG] Saving email to database...")
-        db.save_email(processed_email)
         return processed_email
 
     except Exception as e:
-        print(f"[ERROR] Error processing email {email.get('id', 'unknown')}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing email %s: %s", email.get('id', 'unknown'), e)
         return None
 
+def process_emails(emails, access_token):
+    """Process a batch of fetched emails, saving new ones in one transaction; keeps input order"""
+    # One query finds the emails a previous sync already processed
+    existing = db.get_emails_by_ids([email['id'] for email in emails])
+    new_emails = [email for email in emails if email['id'] not in existing]
+    logger.debug("%s emails already processed, %s new", len(emails) - len(new_emails), len(new_emails))
+
+    # Obvious spam never reaches the model. The rules need footers, so previews are
+    # checked in analyze_email once their full body has been fetched
+    new_emails = [email for email in new_emails
+                  if email.get('is_preview') or validate_email_relevance(email['body'], email['subject'])]
+
+    # Classify the whole batch up front: several emails share each prompt and the calls overlap
+    try:
+        relevance = ai_service.classify_batch([(email['body'], email['subject']) for email in new_emails])
+    except Exception as e:
+        logger.error("Batch relevance check failed, classifying per email: %s", e)
+        relevance = [None] * len(new_emails)
+
+    # Reply status for every candidate in one Graph query per batch of threads, not one per email
+    candidates = [email for email, is_relevant in zip(new_emails, relevance) if is_relevant is not False]
+    try:
+        replied = email_service.check_replies_bulk(
+            access_token, [email['id'] for email in candidates],
+            {email['id']: email.get('conversation_id') for email in candidates}
+        ) if candidates else {}
+    except Exception as e:
+        logger.error("Bulk reply check failed, checking per email: %s", e)
+        replied = {}
+
+    # Each email waits on Graph and Ollama, so process them concurrently; map keeps inbox order
+    results = executor.map(
+        lambda email, is_relevant: analyze_email(email, access_token, is_relevant, replied.get(email['id'])),
+        new_emails, relevance
+    )
+    analyzed = {result['id']: result for result in results if result}
+    db.save_emails_bulk(list(analyzed.values()))
+
+    processed_emails = [existing.get(email['id']) or analyzed.get(email['id']) for email in emails]
+    processed_emails = [email for email in processed_emails if email]
+    return processed_emails
+
 @app.route('/api/emails/sync', methods=['POST'])
 def sync_emails():
     """Sync recent emails and process them with AI"""
     access_token = get_valid_token()
     if not access_token:
-        print("[ERROR] Sync attempted without valid authentication")
+        logger.error("Sync attempted without valid authentication")
         return jsonify({'error': 'Not authenticated'}), 401
 
-    print("[DEBUG] Starting email sync...")
+    logger.debug("Starting email sync...")
     try:
         emails = email_service.get_recent_emails(access_token, limit=20)
-        print(f"[DEBUG] Retrieved {len(emails) if emails else 0} emails from API")
+        logger.debug("Retrieved %s emails from API", len(emails) if emails else 0)
 
         if not emails:
             return jsonify({'message': 'No emails found', 'emails': []})
 
-        processed_emails = []
-        for email in emails:
-            result = process_email(email, access_token)
-            if result:
-                processed_emails.append(result)
-
+        processed_emails = process_emails(emails, access_token)
         db.update_last_sync()
-        print(f"[DEBUG] Sync completed. Processed {len(processed_emails)} emails")
+        logger.debug("Sync completed. Processed %s emails", len(processed_emails))
 
         return jsonify({
             'message': f'Processed {len(processed_emails)} relevant emails',
@@ -289,20 +536,18 @@ def sync_emails():
         })
 
     except Exception as e:
-        print(f"[ERROR] Sync failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Sync failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/emails')
 def get_emails():
-    """Get all processed relevant emails"""
+    """Get all processed relevant emails; bodies come from the per-email endpoint"""
     try:
-        emails = db.get_all_emails()
-        print(f"[DEBUG] Retrieved {len(emails)} relevant emails from database")
+        emails = db.get_all_emails_summary()
+        logger.debug("Retrieved %s relevant emails from database", len(emails))
         return jsonify({'emails': emails})
     except Exception as e:
-        print(f"[ERROR] Failed to get emails: {str(e)}")
+        logger.error("Failed to get emails: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/emails/<email_id>')
@@ -321,11 +566,11 @@ def get_email_details(email_id):
                 if full_email:
                     email['full_body'] = full_email['body']
             except Exception as e:
-                print(f"[ERROR] Failed to get full email content: {str(e)}")
+                logger.error("Failed to get full email content: %s", e)
 
         return jsonify({'email': email})
     except Exception as e:
-        print(f"[ERROR] Failed to get email details: {str(e)}")
+        logger.error("Failed to get email details: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/emails/<email_id>/reply', methods=['POST'])
@@ -333,65 +578,28 @@ def send_reply(email_id):
     """Send reply to an email"""
     access_token = get_valid_token()
     if not access_token:
-        print("[ERROR] Reply attempted without valid authentication")
+        logger.error("Reply attempted without valid authentication")
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
-        data = request.get_json()
-        print(f"[DEBUG] Raw request data: {data}")
-        print(f"[DEBUG] Data type: {type(data)}")
-        
-        # Extract reply content properly
-        reply_content = None
-        if isinstance(data, dict):
-            if 'content' in data:
-                content_value = data['content']
-                # Handle nested content structure
-                if isinstance(content_value, dict) and 'content' in content_value:
-                    reply_content = content_value['content']
-                    print(f"[DEBUG] Extracted content from nested 'content' key")
-                else:
-                    reply_content = content_value
-                    print(f"[DEBUG] Extracted content from 'content' key")
-            elif 'reply_content' in data:
-                reply_content = data['reply_content']
-                print(f"[DEBUG] Extracted content from 'reply_content' key")
-            else:
-                # If data itself contains the message
-                print(f"[DEBUG] Data keys: {list(data.keys())}")
-                reply_content = str(data)
-        else:
-            reply_content = str(data)
-        
-        # Ensure reply_content is a string
-        if isinstance(reply_content, dict):
-            # If it's still a dict, try to extract content or convert to string
-            if 'content' in reply_content:
-                reply_content = reply_content['content']
-            else:
-                reply_content = str(reply_content)
-        
-        # Convert to string if it's not already
-        reply_content = str(reply_content) if reply_content is not None else ""
-        
-        print(f"[DEBUG] Final reply_content type: {type(reply_content)}")
-        print(f"[DEBUG] Final reply_content: {reply_content[:200]}...")
+        reply_content = extract_reply_content(request.get_json(silent=True))
+        logger.debug("Reply content: %s...", reply_content[:200])
         
         if not reply_content or reply_content.strip() == '':
             return jsonify({'error': 'Reply content is required'}), 400
 
-        print(f"[DEBUG] Sending reply to email {email_id}")
+        logger.debug("Sending reply to email %s", email_id)
         
         # Check if this email exists in our database and get the original ID
         email_record = db.get_email_by_id(email_id)
         if email_record:
             # Use the ID from our database (which should be the original email ID)
             original_email_id = email_record['id']
-            print(f"[DEBUG] Using original email ID from database: {original_email_id}")
+            logger.debug("Using original email ID from database: %s", original_email_id)
         else:
             # Use the provided ID
             original_email_id = email_id
-            print(f"[DEBUG] Using provided email ID: {original_email_id}")
+            logger.debug("Using provided email ID: %s", original_email_id)
 
         # Send reply
         success = email_service.send_reply(
@@ -401,7 +609,7 @@ def send_reply(email_id):
         )
 
         if success:
-            print(f"[DEBUG] Reply sent successfully")
+            logger.debug("Reply sent successfully")
             # Mark the original email as replied in the database
             if email_record:
                 db.mark_as_replied(email_record['id'])
@@ -409,15 +617,23 @@ def send_reply(email_id):
                 db.mark_as_replied(email_id)
             return jsonify({'message': 'Reply sent successfully'})
         else:
-            print(f"[ERROR] Failed to send reply")
+            logger.error("Failed to send reply")
             return jsonify({'error': 'Failed to send reply. Please try again.'}), 500
 
     except Exception as e:
-        print(f"[ERROR] Reply failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Reply failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def get_reply_context(email_id):
+    """Conversation messages used as reply context, or [] without a valid token"""
+    access_token = get_valid_token()
+    if access_token:
+        try:
+            return email_service.get_conversation_context(access_token, email_id)
+        except Exception as e:
+            logger.error("Failed to get conversation context: %s", e)
+    return []
+
 @app.route('/api/emails/<email_id>/regenerate-reply', methods=['POST'])
 def regenerate_reply(email_id):
     """Regenerate draft reply for an email"""
@@ -426,13 +642,7 @@ def regenerate_reply(email_id):
         if not email or not email.get('is_relevant', True):
             return jsonify({'error': 'Email not found'}), 404
 
-        context = []
-        access_token = get_valid_token()
-        if access_token:
-            try:
-                context = email_service.get_conversation_context(access_token, email_id)
-            except Exception as e:
-                print(f"[ERROR] Failed to get conversation context: {str(e)}")
+        context = get_reply_context(email_id)
 
         # Generate new reply
         try:
@@ -442,7 +652,7 @@ def regenerate_reply(email_id):
                 context
             )
         except Exception as e:
-            print(f"[ERROR] AI reply generation failed: {str(e)}")
+            logger.error("AI reply generation failed: %s", e)
             new_reply = "Thank you for your email. I'll review this and get back to you soon.\n\nBest regards"
 
         # Update database
@@ -451,18 +661,49 @@ def regenerate_reply(email_id):
         return jsonify({'draft_reply': new_reply})
 
     except Exception as e:
-        print(f"[ERROR] Failed to regenerate reply: {str(e)}")
+        logger.error("Failed to regenerate reply: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def sse_event(data):
+    """Format one server-sent event carrying a JSON payload"""
+    return b"data: " + json_dumps(data) + b"\n\n"
+
+@app.route('/api/emails/<email_id>/regenerate-reply/stream', methods=['POST'])
+def regenerate_reply_stream(email_id):
+    """Regenerate the draft reply as server-sent events: text deltas, then the final draft"""
+    email = db.get_email_by_id(email_id)
+    if not email or not email.get('is_relevant', True):
+        return jsonify({'error': 'Email not found'}), 404
+
+    # Resolve the token and context now; the session is read-only once the stream starts
+    context = get_reply_context(email_id)
+
+    def events():
+        parts = []
+        try:
+            for text in ai_service.generate_reply_stream(email['body'], email['subject'], context):
+                parts.append(text)
+                yield sse_event({'text': text})
+        except Exception as e:
+            logger.error("AI reply streaming failed: %s", e)
+
+        # The streamed text is raw model output; the saved draft gets the greeting and closing
+        new_reply = ai_service.finish_reply(''.join(parts), context)
+        db.update_draft_reply(email_id, new_reply)
+        yield sse_event({'done': True, 'draft_reply': new_reply})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/stats')
 def get_stats():
     """Get email statistics"""
     try:
         stats = db.get_email_stats()
-        print(f"[DEBUG] Email stats: {stats}")
+        logger.debug("Email stats: %s", stats)
         return jsonify({'stats': stats})
     except Exception as e:
-        print(f"[ERROR] Failed to get stats: {str(e)}")
+        logger.error("Failed to get stats: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/debug/session')
@@ -509,7 +750,8 @@ def debug_ollama_test():
                 'ollama_working': True,
                 'health': health,
                 'test_summary': test_summary,
-                'test_reply': test_reply
+                'test_reply': test_reply,
+                'load': ai_service.get_load_stats()
             })
         else:
             return jsonify({
@@ -526,17 +768,41 @@ def debug_ollama_test():
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """Clear session and logout"""
+    drop_mail_subscription(active_tokens.get('current'))
     session.clear()
     active_tokens.clear()
-    print("[DEBUG] User logged out, session cleared")
+    token_ready.clear()
+    # The delta position belongs to this mailbox
+    db.set_sync_value('inbox_delta_link', '')
+    logger.debug("User logged out, session cleared")
     return jsonify({'message': 'Logged out successfully'})
 
-if __name__ == '__main__':
-    print("[DEBUG] Starting Flask application...")
-    print(f"[DEBUG] Frontend URL: {os.getenv('FRONTEND_URL')}")
-    print(f"[DEBUG] Ollama health: {ai_service.check_health()}")
-    
-    # Start background email checker
+def configure_logging():
+    """Set up log output once per process"""
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+    )
+
+def stop_background_tasks():
+    """Wake every background loop so it sees the shutdown flag and exits"""
+    shutdown_requested.set()
+    token_ready.set()
+    email_check_requested.set()
+
+def start_background_tasks():
+    """Start the background email checker and token refresher"""
+    logger.info("Frontend URL: %s", FRONTEND_URL)
+    logger.info("Ollama health: %s", ai_service.check_health())
     threading.Thread(target=background_email_check, daemon=True).start()
+    threading.Thread(target=background_token_refresh, daemon=True).start()
+    atexit.register(stop_background_tasks)
+
+if __name__ == '__main__':
+    # Development server only; production runs under gunicorn via wsgi.py
+    configure_logging()
+    logger.info("Starting Flask application...")
+    start_background_tasks()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The reloader would run a second copy of the background threads
+    app.run(debug=bool(os.getenv('DEV')), use_reloader=False, threaded=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,12 +1,43 @@
 import requests
+import re
+import html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlencode
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import secrets
 import hashlib
 import base64
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils import json_loads
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+logger = logging.getLogger(__name__)
+
+def _graph_timestamp(delta: timedelta = timedelta()) -> str:
+    """UTC time offset by delta, in the form Graph returns receivedDateTime (so strings compare in order)"""
+    return (datetime.now(timezone.utc) + delta).isoformat(timespec='seconds').replace('+00:00', 'Z')
+
+# HTML-to-text: drop non-visible blocks (newsletter CSS can be most of the body), then tags
+_HIDDEN_HTML_RE = re.compile(r'<(style|script|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_HTML_TAG_RE = re.compile(r'<[^<]+?>')
+_INLINE_SPACE_RE = re.compile(r'[^\S\n]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*')
+# An existing "Re:"/"RE :" prefix in any case, replaced by one canonical "RE: " on reply
+_REPLY_PREFIX_RE = re.compile(r'^\s*re\s*:\s*', re.IGNORECASE)
+# Outlook HTML past this size is almost all markup; callers only keep the first few KB of text
+_MAX_HTML_CHARS = 1_000_000
 
 class OutlookEmailService:
     """Service for interacting with Microsoft Outlook/Graph API"""
@@ -18,8 +49,88 @@ class OutlookEmailService:
         self.scope = 'https://graph.microsoft.com/Mail.Read https://graph.microsoft.com/Mail.Send https://graph.microsoft.com/Mail.ReadWrite'
         self.auth_base_url = 'https://login.microsoftonline.com/common/oauth2/v2.0'
         self.graph_base_url = 'https://graph.microsoft.com/v1.0'
+        self.graph_max_concurrency = 4
+        # Graph endpoints every call builds on
+        self._me_url = f"{self.graph_base_url}/me"
+        self._messages_url = f"{self._me_url}/messages"
+        self._inbox_messages_url = f"{self._me_url}/mailFolders/Inbox/messages"
+        self._subscriptions_url = f"{self.graph_base_url}/subscriptions"
+        # Headers for the most recent access token; one token serves many calls in a row
+        self._headers_cache = (None, None)
+        # Threads per bulk reply-status query; keeps the OR'd $filter well inside URL limits
+        self.conversation_filter_chunk = 15
+        # Fields every token request repeats
+        self._token_request_base = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': self.scope
+        }
         self.code_verifier = None
         self.code_challenge = None
+        # Authorization URL up to the per-login PKCE challenge
+        self._auth_url_base = f"{self.auth_base_url}/authorize?" + urlencode({
+            'client_id': self.client_id,
+            'response_type': 'code',
+            'redirect_uri': self.redirect_uri,
+            'scope': self.scope,
+            'response_mode': 'query',
+            'code_challenge_method': 'S256'
+        })
+        # Reuse TLS connections to Graph and the token endpoint across calls and threads.
+        # Throttled or briefly unavailable reads are retried (honoring Retry-After); POST and
+        # PATCH are not idempotent and keep failing fast
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+        self.session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry))
+        # Outlook throttles an app to 4 concurrent requests per mailbox, so fan-outs beyond that only
+        # earn 429s and Retry-After waits. Callers past the limit wait for a free slot in _graph_request,
+        # for at most graph_slot_wait seconds, instead of blocking on the pool indefinitely
+        self.session.mount(self.graph_base_url, HTTPAdapter(pool_maxsize=self.graph_max_concurrency,
+                                                            max_retries=retry))
+        self._graph_slots = threading.BoundedSemaphore(self.graph_max_concurrency)
+        self.graph_slot_wait = 30
+        # (connect, read) seconds for every outbound call, so a hung request can't hold a slot forever
+        self.request_timeout = (5, 30)
+        self.session.headers['User-Agent'] = 'smart-email-assistant/1.0'
+        # Signed-in user's address per access token; it never changes for a token's lifetime
+        self._my_email_cache = {}
+        self._my_email_lock = threading.Lock()
+        self.my_email_ttl = 3600
+        # Runs a /me lookup alongside the caller's conversation query; threads start on first miss
+        self._lookup_pool = ThreadPoolExecutor(max_workers=2)
+        # Recently fetched messages; reply, context and reply-status lookups hit the same IDs in quick succession.
+        # Concurrent misses for one ID share a single in-flight request
+        self._email_cache = OrderedDict()
+        self._email_inflight = {}
+        self._email_lock = threading.Lock()
+        self.email_cache_size = 512
+        self.email_cache_ttl = 60
+        # Tokens minted per refresh token, with their absolute expiry. Request handlers and the
+        # background refresher can all notice expiry at once; only one of them hits the token endpoint
+        self._token_cache = {}
+        self._refresh_lock = threading.Lock()
+        # Longer than app.py's refresh buffer, so a reused token is never one that is already due
+        self.token_reuse_margin = 600
+
+    def _graph_headers(self, access_token: str) -> Dict[str, str]:
+        """Request headers for a Graph call, reused while the token stays the same"""
+        token, headers = self._headers_cache
+        if token != access_token:
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            self._headers_cache = (access_token, headers)
+        return headers
+
+    def _graph_request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a Graph request once one of the concurrency slots is free"""
+        if not self._graph_slots.acquire(timeout=self.graph_slot_wait):
+            raise requests.exceptions.ConnectTimeout(f"No free Graph connection after {self.graph_slot_wait}s")
+        try:
+            return self.session.request(method, url, timeout=self.request_timeout, **kwargs)
+        finally:
+            self._graph_slots.release()
 
     def _generate_pkce(self):
         """Generate PKCE code verifier and challenge"""
@@ -31,79 +142,93 @@ class OutlookEmailService:
     def get_auth_url(self) -> str:
         """Generate OAuth2 authorization URL with PKCE"""
         self._generate_pkce()
-        
-        params = {
-            'client_id': self.client_id,
-            'response_type': 'code',
-            'redirect_uri': self.redirect_uri,
-            'scope': self.scope,
-            'response_mode': 'query',
-            'code_challenge': self.code_challenge,
-            'code_challenge_method': 'S256'
-        }
-        return f"{self.auth_base_url}/authorize?{urlencode(params)}"
+        return f"{self._auth_url_base}&{urlencode({'code_challenge': self.code_challenge})}"
 
     def get_access_token(self, auth_code: str) -> Optional[Dict]:
         """Exchange authorization code for access token with PKCE"""
         token_url = f"{self.auth_base_url}/token"
         
         data = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
+            **self._token_request_base,
             'code': auth_code,
             'grant_type': 'authorization_code',
             'redirect_uri': self.redirect_uri,
-            'scope': self.scope,
             'code_verifier': self.code_verifier
         }
         
         try:
-            response = requests.post(token_url, data=data)
-            print(f"[DEBUG] Token response status: {response.status_code}")
+            response = self.session.post(token_url, data=data, timeout=self.request_timeout)
+            logger.debug("Token response status: %s", response.status_code)
             if response.status_code == 200:
-                token_data = response.json()
-                print(f"[DEBUG] Token data keys: {list(token_data.keys())}")
+                token_data = json_loads(response.content)
+                logger.debug("Token data keys: %s", token_data.keys())
                 return token_data
             else:
-                print(f"[ERROR] Token request failed: {response.text}")
+                logger.error("Token request failed: %s", response.text)
         except Exception as e:
-            print(f"Error getting access token: {str(e)}")
+            logger.error("Error getting access token: %s", e)
         
         return None
 
     def refresh_access_token(self, refresh_token: str) -> Optional[Dict]:
-        """Refresh an expired access token"""
+        """Refresh an expired access token, reusing a token another caller just got for the same refresh token"""
+        cached = self._cached_token(refresh_token)
+        if cached:
+            return cached
+        
+        with self._refresh_lock:
+            # Whoever held the lock may have refreshed already
+            cached = self._cached_token(refresh_token)
+            if cached:
+                return cached
+            
+            token_data = self._request_token_refresh(refresh_token)
+            if token_data:
+                now = time.time()
+                self._token_cache = {
+                    key: entry for key, entry in self._token_cache.items() if entry[1] > now
+                }
+                self._token_cache[refresh_token] = (token_data, now + token_data.get('expires_in', 3600))
+            return token_data
+    
+    def _cached_token(self, refresh_token: str) -> Optional[Dict]:
+        """Still-fresh token for refresh_token, with expires_in counting from now"""
+        entry = self._token_cache.get(refresh_token)
+        if entry:
+            token_data, expires_at = entry
+            remaining = expires_at - time.time()
+            if remaining > self.token_reuse_margin:
+                return {**token_data, 'expires_in': int(remaining)}
+        return None
+    
+    def _request_token_refresh(self, refresh_token: str) -> Optional[Dict]:
+        """Exchange a refresh token at the token endpoint"""
         token_url = f"{self.auth_base_url}/token"
         
         data = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
+            **self._token_request_base,
             'refresh_token': refresh_token,
-            'grant_type': 'refresh_token',
-            'scope': self.scope
+            'grant_type': 'refresh_token'
         }
         
         try:
-            response = requests.post(token_url, data=data)
-            print(f"[DEBUG] Refresh token response status: {response.status_code}")
+            response = self.session.post(token_url, data=data, timeout=self.request_timeout)
+            logger.debug("Refresh token response status: %s", response.status_code)
             if response.status_code == 200:
-                return response.json()
+                return json_loads(response.content)
             else:
-                print(f"[ERROR] Token refresh failed: {response.text}")
+                logger.error("Token refresh failed: %s", response.text)
         except Exception as e:
-            print(f"Error refreshing token: {str(e)}")
+            logger.error("Error refreshing token: %s", e)
         
         return None
 
     def send_reply(self, access_token: str, original_email_id: str, reply_content: str) -> bool:
         """Send reply to an email"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        headers = self._graph_headers(access_token)
         
         try:
-            print(f"[DEBUG] Preparing to send reply to email {original_email_id}")
+            logger.debug("Preparing to send reply to email %s", original_email_id)
             
             # Make sure reply_content is a string
             if isinstance(reply_content, dict):
@@ -111,72 +236,48 @@ class OutlookEmailService:
             else:
                 content_text = str(reply_content)
             
-            print(f"[DEBUG] Processed reply content: {content_text[:100]}...")
-            
-            # First, get the original email to extract sender information
-            original_email = self.get_email_by_id(access_token, original_email_id)
-            if not original_email:
-                print(f"[ERROR] Could not fetch original email {original_email_id}")
-                return False
-            
-            sender_email = original_email['sender']
-            sender_name = original_email.get('sender_name', '')
-            subject = original_email['subject']
+            logger.debug("Processed reply content: %.100s...", content_text)
             
-            print(f"[DEBUG] Replying to: {sender_email} with subject: {subject}")
-            
-            # Try method 1: Use createReply endpoint
-            reply_url = f"{self.graph_base_url}/me/messages/{original_email_id}/createReply"
-            
-            response = requests.post(reply_url, headers=headers)
-            
-            if response.status_code == 201:
-                # Method 1 worked - proceed with draft update
-                reply_draft = response.json()
-                draft_id = reply_draft['id']
-                
-                print(f"[DEBUG] Reply draft created with ID: {draft_id}")
-                
-                # Update the reply with our content
-                update_url = f"{self.graph_base_url}/me/messages/{draft_id}"
-                
-                update_payload = {
+            # Try method 1: the reply action creates, fills and sends the reply in one request.
+            # Writable properties in "message" (here the body) replace the draft's defaults, which is
+            # what createReply + PATCH + send did in three round trips
+            reply_url = f"{self._messages_url}/{original_email_id}/reply"
+            reply_payload = {
+                "message": {
                     "body": {
                         "contentType": "Text",
                         "content": content_text
                     }
                 }
+            }
+            
+            response = self._graph_request('POST', reply_url, headers=headers, json=reply_payload)
+            
+            if response.status_code == 202:
+                logger.debug("Reply sent successfully using reply method")
+                return True
+            else:
+                # Method 1 failed, try method 2: Direct send
+                logger.debug("reply failed (%s), trying direct send method", response.status_code)
+                logger.debug("reply error: %s", response.text)
                 
-                print(f"[DEBUG] Updating reply with content...")
-                update_response = requests.patch(update_url, headers=headers, json=update_payload)
-                
-                if update_response.status_code != 200:
-                    print(f"[ERROR] Failed to update reply content: {update_response.status_code} - {update_response.text}")
+                # Method 2 addresses the reply itself, so it needs the original sender and subject
+                original_email = self.get_email_by_id(access_token, original_email_id)
+                if not original_email:
+                    logger.error("Could not fetch original email %s", original_email_id)
                     return False
                 
-                print(f"[DEBUG] Reply content updated successfully")
+                sender_email = original_email['sender']
+                sender_name = original_email.get('sender_name', '')
+                subject = original_email['subject']
                 
-                # Send the reply
-                send_url = f"{self.graph_base_url}/me/messages/{draft_id}/send"
-                send_response = requests.post(send_url, headers=headers)
-                
-                if send_response.status_code == 202:
-                    print(f"[DEBUG] Reply sent successfully using createReply method")
-                    return True
-                else:
-                    print(f"[ERROR] Failed to send reply: {send_response.status_code} - {send_response.text}")
-                    return False
-            
-            else:
-                # Method 1 failed, try method 2: Direct send
-                print(f"[DEBUG] createReply failed ({response.status_code}), trying direct send method")
-                print(f"[DEBUG] createReply error: {response.text}")
+                logger.debug("Replying to: %s with subject: %s", sender_email, subject)
                 
                 # Method 2: Send reply directly
-                send_url = f"{self.graph_base_url}/me/sendMail"
+                send_url = f"{self._me_url}/sendMail"
                 
                 # Build reply subject
-                reply_subject = subject if subject.startswith('RE:') else f"RE: {subject}"
+                reply_subject = f"RE: {_REPLY_PREFIX_RE.sub('', subject, count=1)}"
                 
                 email_payload = {
                     "message": {
@@ -202,101 +303,212 @@ class OutlookEmailService:
                     }
                 }
                 
-                print(f"[DEBUG] Sending reply directly to {sender_email}")
-                direct_response = requests.post(send_url, headers=headers, json=email_payload)
+                logger.debug("Sending reply directly to %s", sender_email)
+                direct_response = self._graph_request('POST', send_url, headers=headers, json=email_payload)
                 
                 if direct_response.status_code == 202:
-                    print(f"[DEBUG] Reply sent successfully using direct send method")
+                    logger.debug("Reply sent successfully using direct send method")
                     return True
                 else:
-                    print(f"[ERROR] Direct send also failed: {direct_response.status_code} - {direct_response.text}")
+                    logger.error("Direct send also failed: %s - %s", direct_response.status_code, direct_response.text)
                     return False
             
         except Exception as e:
-            print(f"[ERROR] Exception in send_reply: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Exception in send_reply: %s", e)
             return False
 
-    def _get_sender_email(self, access_token: str, email_id: str) -> str:
-        """Get sender email address for a message"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+    def _cached_my_email(self, access_token: str) -> Optional[str]:
+        with self._my_email_lock:
+            cached = self._my_email_cache.get(access_token)
+        if cached and time.monotonic() - cached[1] < self.my_email_ttl:
+            return cached[0]
+        return None
+    
+    def get_my_email_async(self, access_token: str) -> Future:
+        """Start the signed-in address lookup so it overlaps other Graph calls; resolved at once when cached"""
+        cached = self._cached_my_email(access_token)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        return self._lookup_pool.submit(self.get_my_email, access_token)
+    
+    def get_my_email(self, access_token: str) -> str:
+        """Get the signed-in user's email address, cached per access token"""
+        cached = self._cached_my_email(access_token)
+        if cached is not None:
+            return cached
+        
+        headers = self._graph_headers(access_token)
         
         try:
-            url = f"{self.graph_base_url}/me/messages/{email_id}"
-            params = {'$select': 'from'}
-            response = requests.get(url, headers=headers, params=params)
-            
+            response = self._graph_request('GET', self._me_url, headers=headers)
             if response.status_code == 200:
-                return response.json()['from']['emailAddress']['address']
+                my_email = (json_loads(response.content).get('mail') or '').lower()
+                with self._my_email_lock:
+                    # Refreshed tokens get new keys, so drop the stale ones
+                    self._my_email_cache = {access_token: (my_email, time.monotonic())}
+                return my_email
+            logger.error("Failed to get current user: %s", response.status_code)
         except Exception as e:
-            print(f"[ERROR] Failed to get sender email: {str(e)}")
+            logger.error("Failed to get current user: %s", e)
         
         return ""
 
-    def get_conversation_context(self, access_token: str, email_id: str) -> List[Dict]:
-        """Get conversation context for better reply generation"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
+    def create_subscription(self, access_token: str, notification_url: str, client_state: str,
+                            lifetime: timedelta) -> Optional[Dict]:
+        """Subscribe to new Inbox messages; Graph POSTs to notification_url when mail arrives"""
+        headers = self._graph_headers(access_token)
+        
+        payload = {
+            'changeType': 'created',
+            'notificationUrl': notification_url,
+            'resource': "me/mailFolders('Inbox')/messages",
+            'expirationDateTime': _graph_timestamp(lifetime),
+            'clientState': client_state
         }
         
         try:
-            # Get the original email to find conversation ID
-            email = self.get_email_by_id(access_token, email_id)
-            if not email:
-                return []
-            
-            conversation_id = email['conversation_id']
-            
-            # Get all messages in conversation
+            response = self._graph_request('POST', self._subscriptions_url, headers=headers, json=payload)
+            if response.status_code == 201:
+                return json_loads(response.content)
+            logger.error("Failed to create subscription: %s - %s", response.status_code, response.text)
+        except Exception as e:
+            logger.error("Failed to create subscription: %s", e)
+        
+        return None
+    
+    def renew_subscription(self, access_token: str, subscription_id: str, lifetime: timedelta) -> bool:
+        """Push a subscription's expiry out by lifetime"""
+        headers = self._graph_headers(access_token)
+        
+        payload = {
+            'expirationDateTime': _graph_timestamp(lifetime)
+        }
+        
+        try:
+            response = self._graph_request('PATCH', f"{self._subscriptions_url}/{subscription_id}",
+                                           headers=headers, json=payload)
+            if response.status_code == 200:
+                return True
+            logger.error("Failed to renew subscription: %s - %s", response.status_code, response.text)
+        except Exception as e:
+            logger.error("Failed to renew subscription: %s", e)
+        
+        return False
+    
+    def delete_subscription(self, access_token: str, subscription_id: str) -> bool:
+        """Stop a subscription's notifications; an already-expired one counts as deleted"""
+        headers = self._graph_headers(access_token)
+        
+        try:
+            response = self._graph_request('DELETE', f"{self._subscriptions_url}/{subscription_id}",
+                                           headers=headers)
+            if response.status_code in (204, 404):
+                return True
+            logger.error("Failed to delete subscription: %s - %s", response.status_code, response.text)
+        except Exception as e:
+            logger.error("Failed to delete subscription: %s", e)
+        
+        return False
+
+    def _get_sender_email(self, access_token: str, email_id: str) -> str:
+        """Get sender email address for a message, from the cached message lookup"""
+        return (self.get_email_by_id(access_token, email_id) or {}).get('sender', '')
+
+    def get_conversation(self, access_token: str, conversation_id: str) -> List[Dict]:
+        """Get the latest messages in a conversation, newest first, with one Graph call"""
+        headers = self._graph_headers(access_token)
+        
+        try:
             params = {
                 '$filter': f"conversationId eq '{conversation_id}'",
                 '$orderby': 'receivedDateTime desc',
-                '$select': 'sender,subject,body,receivedDateTime',
-                '$top': 5
+                '$select': 'id,sender,subject,bodyPreview,receivedDateTime',
+                '$top': 10
             }
             
-            url = f"{self.graph_base_url}/me/messages"
-            response = requests.get(url, headers=headers, params=params)
+            url = self._messages_url
+            response = self._graph_request('GET', url, headers=headers, params=params)
             
             if response.status_code == 200:
-                messages = response.json().get('value', [])
-                context = []
-                
-                for message in messages:
-                    context.append({
-                        'sender': message['sender']['emailAddress']['address'],
-                        'subject': message['subject'],
-                        'body': self._extract_text_from_body(message['body'])[:500],
-                        'timestamp': message['receivedDateTime']
-                    })
-                
-                return context
+                # Drafts have no sender yet; skip them rather than lose the whole thread
+                return [{
+                    'id': message['id'],
+                    'sender': message['sender']['emailAddress']['address'],
+                    'subject': message['subject'],
+                    # Context only needs a snippet; the plain-text preview avoids downloading HTML bodies
+                    'body': message['bodyPreview'],
+                    'timestamp': message['receivedDateTime']
+                } for message in json_loads(response.content).get('value', []) if message.get('sender')]
         except Exception as e:
-            print(f"Error getting conversation context: {str(e)}")
+            logger.error("Error getting conversation: %s", e)
         
         return []
     
+    @staticmethod
+    def has_reply(conversation: List[Dict], email_id: str, my_email: str) -> bool:
+        """Whether the user sent any message in the conversation other than the email itself"""
+        return bool(my_email) and any(
+            message['sender'].lower() == my_email and message['id'] != email_id
+            for message in conversation
+        )
+    
+    def get_conversation_context(self, access_token: str, email_id: str) -> List[Dict]:
+        """Get conversation context for better reply generation"""
+        # Get the original email to find conversation ID
+        email = self.get_email_by_id(access_token, email_id)
+        if not email:
+            return []
+        
+        return self.get_conversation(access_token, email['conversation_id'])[:5]
+    
     def get_email_by_id(self, access_token: str, email_id: str) -> Optional[Dict]:
-        """Get full email details by ID"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        """Get full email details by ID, reusing a recent or in-flight fetch of the same message"""
+        with self._email_lock:
+            cached = self._email_cache.get(email_id)
+            if cached and time.monotonic() - cached[1] < self.email_cache_ttl:
+                self._email_cache.move_to_end(email_id)
+                return dict(cached[0])
+            pending = self._email_inflight.get(email_id)
+            if pending is None:
+                pending = self._email_inflight[email_id] = Future()
+                owner = True
+            else:
+                owner = False
+        
+        if not owner:
+            email = pending.result()
+            return dict(email) if email else None
         
+        email = None
         try:
-            url = f"{self.graph_base_url}/me/messages/{email_id}"
+            email = self._fetch_email_by_id(access_token, email_id)
+        finally:
+            with self._email_lock:
+                del self._email_inflight[email_id]
+                if email:
+                    self._email_cache[email_id] = (email, time.monotonic())
+                    self._email_cache.move_to_end(email_id)
+                    if len(self._email_cache) > self.email_cache_size:
+                        self._email_cache.popitem(last=False)
+            pending.set_result(email)
+        # Callers annotate the dict they get back, so never hand out the cached one
+        return dict(email) if email else None
+    
+    def _fetch_email_by_id(self, access_token: str, email_id: str) -> Optional[Dict]:
+        """Get full email details by ID from Graph"""
+        headers = self._graph_headers(access_token)
+        
+        try:
+            url = f"{self._messages_url}/{email_id}"
             params = {
                 '$select': 'id,sender,subject,body,receivedDateTime,conversationId'
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = self._graph_request('GET', url, headers=headers, params=params)
             if response.status_code == 200:
-                email = response.json()
+                email = json_loads(response.content)
                 return {
                     'id': email['id'],
                     'sender': email['sender']['emailAddress']['address'],
@@ -307,43 +519,44 @@ class OutlookEmailService:
                     'conversation_id': email['conversationId']
                 }
             else:
-                print(f"[ERROR] Failed to get email by ID: {response.status_code} - {response.text}")
+                logger.error("Failed to get email by ID: %s - %s", response.status_code, response.text)
         except Exception as e:
-            print(f"Error getting email by ID: {str(e)}")
+            logger.error("Error getting email by ID: %s", e)
         
         return None
 
     def get_recent_emails(self, access_token: str, limit: int = 20) -> List[Dict]:
-        """Fetch recent emails from inbox"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        """Fetch recent emails from inbox; bodies are Graph's plain-text preview (see get_email_by_id)"""
+        headers = self._graph_headers(access_token)
         
-        since_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        # Newest first with $top is cheap for Graph; the one-week cutoff is applied here instead of as a $filter
+        since_date = _graph_timestamp(-timedelta(days=7))
         
         params = {
             '$top': limit,
             '$orderby': 'receivedDateTime desc',
-            '$filter': f"receivedDateTime ge {since_date}",
-            '$select': 'id,sender,subject,body,receivedDateTime,isRead,hasAttachments,conversationId'
+            '$select': 'id,sender,subject,bodyPreview,receivedDateTime,isRead,hasAttachments,conversationId'
         }
         
         try:
-            url = f"{self.graph_base_url}/me/messages"
-            response = requests.get(url, headers=headers, params=params)
+            # Inbox only: our own sent replies live in Sent Items and never come back
+            url = self._inbox_messages_url
+            response = self._graph_request('GET', url, headers=headers, params=params)
             
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 emails = []
                 
                 for email in data.get('value', []):
+                    if email['receivedDateTime'] < since_date:
+                        break
                     processed_email = {
                         'id': email['id'],
                         'sender': email['sender']['emailAddress']['address'],
                         'sender_name': email['sender']['emailAddress']['name'],
                         'subject': email['subject'],
-                        'body': self._extract_text_from_body(email['body']),
+                        'body': email['bodyPreview'],
+                        'is_preview': True,
                         'timestamp': email['receivedDateTime'],
                         'is_read': email['isRead'],
                         'has_attachments': email['hasAttachments'],
@@ -352,100 +565,142 @@ class OutlookEmailService:
                     }
                     emails.append(processed_email)
                 
-                print(f"[DEBUG] Successfully fetched {len(emails)} emails")
+                logger.debug("Successfully fetched %s emails", len(emails))
                 return emails
             else:
-                print(f"[ERROR] Failed to fetch emails: {response.status_code} - {response.text}")
+                logger.error("Failed to fetch emails: %s - %s", response.status_code, response.text)
         except Exception as e:
-            print(f"Error fetching emails: {str(e)}")
+            logger.error("Error fetching emails: %s", e)
         
         return []
     
-    def get_new_emails_since_last_sync(self, access_token: str) -> List[Dict]:
-        """Get new emails since last sync (for live monitoring)"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+    def get_new_emails_since_last_sync(self, access_token: str,
+                                       delta_link: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get Inbox messages added since delta_link (for live monitoring), plus the link to resume from"""
+        headers = {**self._graph_headers(access_token), 'Prefer': 'odata.maxpagesize=50'}
         
-        since_date = (datetime.now() - timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-        
-        params = {
-            '$top': 5,
-            '$orderby': 'receivedDateTime desc',
-            '$filter': f"receivedDateTime ge {since_date}",
-            '$select': 'id,sender,subject,body,receivedDateTime,conversationId'
-        }
+        if delta_link:
+            url, params = delta_link, None
+        else:
+            # Without a saved position, start from the last 10 minutes rather than the whole Inbox
+            since_date = _graph_timestamp(-timedelta(minutes=10))
+            url = f"{self._inbox_messages_url}/delta"
+            params = {
+                '$filter': f"receivedDateTime ge {since_date}",
+                '$select': 'id,sender,subject,bodyPreview,receivedDateTime,conversationId'
+            }
         
+        emails = []
+        # Where the next call should pick up: past every page returned here, even when the
+        # page cap below stops this round early
+        resume_link = delta_link
         try:
-            url = f"{self.graph_base_url}/me/messages"
-            response = requests.get(url, headers=headers, params=params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                emails = []
+            # Follow nextLinks until Graph hands back the deltaLink for the next round
+            for _ in range(20):
+                response = self._graph_request('GET', url, headers=headers, params=params)
+                if response.status_code != 200:
+                    logger.error("Delta query failed: %s - %s", response.status_code, response.text)
+                    if delta_link:
+                        # Expired or invalid position: start over from a fresh window
+                        return self.get_new_emails_since_last_sync(access_token)
+                    return [], None
                 
+                data = json_loads(response.content)
                 for email in data.get('value', []):
-                    processed_email = {
+                    # Deleted or moved messages come back as bare IDs
+                    if '@removed' in email or 'sender' not in email:
+                        continue
+                    emails.append({
                         'id': email['id'],
                         'sender': email['sender']['emailAddress']['address'],
                         'sender_name': email['sender']['emailAddress']['name'],
                         'subject': email['subject'],
-                        'body': self._extract_text_from_body(email['body']),
+                        'body': email['bodyPreview'],
+                        'is_preview': True,
                         'timestamp': email['receivedDateTime'],
                         'conversation_id': email['conversationId'],
                         'priority': 'high' if 'urgent' in email['subject'].lower() else 'medium'
-                    }
-                    emails.append(processed_email)
+                    })
                 
-                return emails
+                if '@odata.deltaLink' in data:
+                    return emails, data['@odata.deltaLink']
+                url, params = data.get('@odata.nextLink'), None
+                if not url:
+                    break
+                resume_link = url
         except Exception as e:
-            print(f"Error fetching new emails: {str(e)}")
+            logger.error("Error fetching new emails: %s", e)
         
-        return []
+        return emails, resume_link
 
-    def check_if_replied(self, access_token: str, email_id: str) -> bool:
-        """Check if a reply has been sent to this email"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
+    def check_replies_bulk(self, access_token: str, email_ids: List[str],
+                           conversation_ids: Optional[Dict[str, str]] = None) -> Dict[str, bool]:
+        """Check reply status for many emails with one conversation query per chunk of threads"""
+        # The signed-in address doesn't depend on the threads, so look it up while they load
+        my_email = self.get_my_email_async(access_token)
+        
+        # Inbox listings already carry conversation IDs; only look up the ones the caller lacks
+        conversation_ids = dict(conversation_ids or {})
+        for email_id in email_ids:
+            if not conversation_ids.get(email_id):
+                email = self.get_email_by_id(access_token, email_id)
+                if email:
+                    conversation_ids[email_id] = email['conversation_id']
+        
+        # Messages of every affected thread, keyed by conversation; threads whose query failed stay absent
+        conversations = {}
+        unique_conversations = list(dict.fromkeys(
+            conversation_ids[email_id] for email_id in email_ids if conversation_ids.get(email_id)
+        ))
+        for start in range(0, len(unique_conversations), self.conversation_filter_chunk):
+            chunk = unique_conversations[start:start + self.conversation_filter_chunk]
+            messages = self._get_conversation_senders(access_token, chunk)
+            if messages is None:
+                continue
+            for conversation_id in chunk:
+                conversations[conversation_id] = []
+            for message in messages:
+                conversations[message['conversation_id']].append(message)
+        
+        # Emails left out could not be checked; callers fall back to the per-email path for them
+        my_email = my_email.result()
+        return {
+            email_id: self.has_reply(conversations[conversation_ids[email_id]], email_id, my_email)
+            for email_id in email_ids
+            if conversation_ids.get(email_id) in conversations
         }
+    
+    def _get_conversation_senders(self, access_token: str, conversation_ids: List[str]) -> Optional[List[Dict]]:
+        """IDs and senders of all messages in the given conversations, or None if Graph could not list them"""
+        headers = self._graph_headers(access_token)
         
+        url = self._messages_url
+        params = {
+            '$filter': ' or '.join(f"conversationId eq '{conversation_id}'" for conversation_id in conversation_ids),
+            '$select': 'id,conversationId,sender',
+            '$top': 100
+        }
+        
+        messages = []
         try:
-            # Get the conversation ID first
-            email = self.get_email_by_id(access_token, email_id)
-            if not email:
-                return False
-                
-            conversation_id = email['conversation_id']
-            
-            # Check for replies in the conversation
-            params = {
-                '$filter': f"conversationId eq '{conversation_id}'",
-                '$select': 'id,subject,internetMessageHeaders,sender',
-                '$orderby': 'receivedDateTime desc'
-            }
-            
-            url = f"{self.graph_base_url}/me/messages"
-            response = requests.get(url, headers=headers, params=params)
-            
-            if response.status_code == 200:
-                messages = response.json().get('value', [])
+            while url:
+                response = self._graph_request('GET', url, headers=headers, params=params)
+                if response.status_code != 200:
+                    logger.error("Failed to get conversations: %s - %s", response.status_code, response.text)
+                    return None
                 
-                # Get current user's email to identify sent messages
-                me_response = requests.get(f"{self.graph_base_url}/me", headers=headers)
-                if me_response.status_code == 200:
-                    my_email = me_response.json().get('mail', '').lower()
-                    
-                    for message in messages:
-                        sender_email = message.get('sender', {}).get('emailAddress', {}).get('address', '').lower()
-                        if sender_email == my_email and message['id'] != email_id:
-                            return True
-            
+                data = json_loads(response.content)
+                messages.extend({
+                    'id': message['id'],
+                    'conversation_id': message['conversationId'],
+                    'sender': message['sender']['emailAddress']['address']
+                } for message in data.get('value', []) if message.get('sender'))
+                url, params = data.get('@odata.nextLink'), None
         except Exception as e:
-            print(f"Error checking reply status: {str(e)}")
+            logger.error("Error getting conversations: %s", e)
+            return None
         
-        return False
+        return messages
 
     def _extract_text_from_body(self, body: Dict) -> str:
         """Extract plain text from email body"""
@@ -458,12 +713,16 @@ class OutlookEmailService:
         if content_type == 'Text':
             return content
         elif content_type == 'HTML':
-            # Simple HTML tag removal
-            import re
-            text = re.sub('<[^<]+?>', '', content)
-            text = text.replace('&nbsp;', ' ').replace('&amp;', '&')
-            text = text.replace('&lt;', '<').replace('&gt;', '>')
-            text = text.replace('&quot;', '"').replace('&#39;', "'")
-            return text.strip()
+            content = content[:_MAX_HTML_CHARS]
+            if HTMLParser is not None:
+                tree = HTMLParser(content)
+                tree.strip_tags(['style', 'script', 'head'])
+                root = tree.body or tree.root
+                # Keep the source's whitespace text so both paths break lines the same way
+                text = root.text(separator='', strip=False) if root is not None else ""
+            else:
+                text = html.unescape(_HTML_TAG_RE.sub('', _HIDDEN_HTML_RE.sub('', content)))
+            text = _INLINE_SPACE_RE.sub(' ', text)
+            return _BLANK_LINES_RE.sub('\n\n', text).strip()
         
         return content
\ No newline at end of file
@@ -1,29 +1,209 @@
 import sqlite3
+import re
 import json
 from datetime import datetime
 from typing import List, Dict, Optional
 import os
+import logging
+import threading
+from utils import parse_email_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Statements run at request time, kept as constants so each thread's connection compiles them once
+# An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row without firing delete
+# triggers, which would leave stale entries in the search index
+_SAVE_EMAIL_SQL = '''
+    INSERT INTO emails 
+    (id, sender, sender_name, subject, body, timestamp, timestamp_unix, summary, 
+     has_reply, draft_reply, is_relevant, conversation_id, priority)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        sender = excluded.sender, sender_name = excluded.sender_name, subject = excluded.subject,
+        body = excluded.body, timestamp = excluded.timestamp, timestamp_unix = excluded.timestamp_unix,
+        summary = excluded.summary,
+        has_reply = excluded.has_reply, draft_reply = excluded.draft_reply,
+        is_relevant = excluded.is_relevant, conversation_id = excluded.conversation_id,
+        priority = excluded.priority
+'''
+_GET_EMAILS_BY_IDS_SQL = 'SELECT * FROM emails WHERE id IN ({}) AND is_relevant = TRUE'
+_GET_EMAIL_SQL = 'SELECT * FROM emails WHERE id = ? AND is_relevant = TRUE'
+_GET_ALL_EMAILS_SQL = '''
+    SELECT * FROM emails 
+    WHERE is_relevant = TRUE
+    ORDER BY timestamp DESC 
+    LIMIT ?
+'''
+# List views render everything but the full body, which is only read when one email is opened;
+# cards without a summary show the short excerpt instead
+_EMAIL_LIST_COLUMNS = '''id, sender, sender_name, subject, timestamp, summary, has_reply, draft_reply,
+        is_relevant, conversation_id, priority, substr(body, 1, 200) AS preview'''
+_GET_ALL_EMAILS_SUMMARY_SQL = f'''
+    SELECT {_EMAIL_LIST_COLUMNS} FROM emails 
+    WHERE is_relevant = TRUE
+    ORDER BY timestamp DESC 
+    LIMIT ?
+'''
+_GET_EMAILS_BY_PRIORITY_SQL = '''
+    SELECT * FROM emails 
+    WHERE is_relevant = TRUE AND priority = ?
+    ORDER BY timestamp DESC
+'''
+_GET_UNREPLIED_EMAILS_SQL = '''
+    SELECT * FROM emails 
+    WHERE has_reply = FALSE AND is_relevant = TRUE
+    ORDER BY timestamp DESC
+'''
+_MARK_REPLIED_SQL = '''
+    UPDATE emails 
+    SET has_reply = TRUE 
+    WHERE id = ?
+'''
+_UPDATE_DRAFT_REPLY_SQL = '''
+    UPDATE emails 
+    SET draft_reply = ? 
+    WHERE id = ?
+'''
+# Total, unreplied, replied and last-24-hours counts in one pass over the relevant emails
+_EMAIL_COUNTS_SQL = '''
+    SELECT
+        COUNT(*),
+        COALESCE(SUM(CASE WHEN has_reply = FALSE THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN has_reply = TRUE THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN timestamp_unix > CAST(strftime('%s', 'now', '-1 day') AS INTEGER) THEN 1 ELSE 0 END), 0)
+    FROM emails
+    WHERE is_relevant = TRUE
+'''
+_PRIORITY_BREAKDOWN_SQL = '''
+    SELECT priority, COUNT(*) as count 
+    FROM emails 
+    WHERE is_relevant = TRUE
+    GROUP BY priority
+'''
+_TOP_SENDERS_SQL = '''
+    SELECT sender, COUNT(*) as count 
+    FROM emails 
+    WHERE is_relevant = TRUE
+    GROUP BY sender 
+    ORDER BY count DESC 
+    LIMIT 5
+'''
+_SET_LAST_SYNC_SQL = '''
+    INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
+    VALUES ('last_sync', ?, CURRENT_TIMESTAMP)
+'''
+_GET_LAST_SYNC_SQL = "SELECT value FROM sync_metadata WHERE key = 'last_sync'"
+_GET_SYNC_VALUE_SQL = 'SELECT value FROM sync_metadata WHERE key = ?'
+_SET_SYNC_VALUE_SQL = '''
+    INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+'''
+_SEARCH_EMAILS_FTS_SQL = '''
+    SELECT e.* FROM emails_fts f
+    JOIN emails e ON e.rowid = f.rowid
+    WHERE emails_fts MATCH ? AND e.is_relevant = TRUE
+    ORDER BY f.rank
+    LIMIT ?
+'''
+_SEARCH_EMAILS_SQL = '''
+    SELECT * FROM emails 
+    WHERE (subject LIKE ? OR sender LIKE ? OR body LIKE ?)
+    AND is_relevant = TRUE
+    ORDER BY timestamp DESC 
+    LIMIT ?
+'''
+_CLEANUP_OLD_EMAILS_SQL = '''
+    DELETE FROM emails 
+    WHERE timestamp_unix < CAST(strftime('%s', 'now', ?) AS INTEGER)
+'''
+
+# Full-text index over the searchable columns, kept in step with emails by triggers
+_CREATE_SEARCH_INDEX_SQL = (
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts
+       USING fts5(subject, sender, body, content='emails', content_rowid='rowid')''',
+    '''CREATE TRIGGER IF NOT EXISTS emails_fts_ai AFTER INSERT ON emails BEGIN
+           INSERT INTO emails_fts(rowid, subject, sender, body) VALUES (new.rowid, new.subject, new.sender, new.body);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS emails_fts_ad AFTER DELETE ON emails BEGIN
+           INSERT INTO emails_fts(emails_fts, rowid, subject, sender, body)
+           VALUES ('delete', old.rowid, old.subject, old.sender, old.body);
+       END''',
+    # Only real edits to indexed columns touch the index: reply flags and drafts never name them,
+    # and the upsert assigns them but usually with the values already stored
+    '''CREATE TRIGGER IF NOT EXISTS emails_fts_au AFTER UPDATE OF subject, sender, body ON emails
+       WHEN old.subject IS NOT new.subject OR old.sender IS NOT new.sender OR old.body IS NOT new.body BEGIN
+           INSERT INTO emails_fts(emails_fts, rowid, subject, sender, body)
+           VALUES ('delete', old.rowid, old.subject, old.sender, old.body);
+           INSERT INTO emails_fts(rowid, subject, sender, body) VALUES (new.rowid, new.subject, new.sender, new.body);
+       END'''
+)
+_SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+def _unix_time(timestamp: str) -> Optional[int]:
+    """Epoch seconds for an email timestamp, or None if it can't be parsed"""
+    parsed = parse_email_timestamp(timestamp)
+    return int(parsed.timestamp()) if parsed else None
 
 class EmailDatabase:
     """SQLite database for storing processed emails"""
     
     def __init__(self, db_path: str = "emails.db"):
         self.db_path = db_path
+        # One connection per thread, kept open: `with conn:` commits or rolls back without closing it,
+        # so each call skips the open and schema load and the statement cache survives between calls
+        self._local = threading.local()
+        # This process is the only writer of last_sync, so the value can live in memory once read
+        self._last_sync = None
+        self._last_sync_loaded = False
+        # Cleared when this SQLite build lacks FTS5; search then falls back to LIKE
+        self._fts_enabled = True
         self.init_database()
     
+    # Per-connection settings: with WAL, commits append to the log without a full sync and readers
+    # never wait on the writer
+    _CONNECTION_PRAGMAS = (
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -20000",
+        "PRAGMA mmap_size = 268435456"
+    )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection, opened with the per-connection PRAGMAs on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            if self.db_path != ':memory:':
+                for pragma in self._CONNECTION_PRAGMAS:
+                    conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+    
+    def _close_connection(self):
+        """Close this thread's connection so the next call reopens the file"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+    
     def init_database(self):
         """Initialize database tables with migration support"""
         try:
             # First, let's check if database exists and backup if needed
             if os.path.exists(self.db_path):
-                print(f"[DEBUG] Database exists at {self.db_path}")
+                logger.debug("Database exists at %s", self.db_path)
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Enable foreign keys
                 cursor.execute("PRAGMA foreign_keys = ON")
                 
+                # WAL is stored in the database file, so setting it once covers every later connection
+                if self.db_path != ':memory:':
+                    cursor.execute("PRAGMA journal_mode = WAL")
+                
                 # Check if emails table exists
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='emails'")
                 emails_table_exists = cursor.fetchone()
@@ -33,36 +213,37 @@ class EmailDatabase:
                 sync_table_exists = cursor.fetchone()
                 
                 if not emails_table_exists or not sync_table_exists:
-                    print("[DEBUG] Creating missing database tables...")
+                    logger.debug("Creating missing database tables...")
                     self._create_fresh_tables(cursor)
                 else:
-                    print("[DEBUG] Database tables exist, checking for migrations...")
+                    logger.debug("Database tables exist, checking for migrations...")
                     self._migrate_database(cursor)
                 
                 conn.commit()
-                print("[DEBUG] Database initialization completed successfully")
+                logger.debug("Database initialization completed successfully")
                 
         except Exception as e:
-            print(f"[ERROR] Database initialization failed: {str(e)}")
+            logger.error("Database initialization failed: %s", e)
             # Try to create fresh database
             try:
+                self._close_connection()
                 if os.path.exists(self.db_path):
                     backup_path = f"{self.db_path}.backup_{int(datetime.now().timestamp())}"
                     os.rename(self.db_path, backup_path)
-                    print(f"[DEBUG] Backed up corrupted database to {backup_path}")
+                    logger.debug("Backed up corrupted database to %s", backup_path)
                 
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     cursor = conn.cursor()
                     self._create_fresh_tables(cursor)
                     conn.commit()
-                    print("[DEBUG] Created fresh database successfully")
+                    logger.debug("Created fresh database successfully")
             except Exception as e2:
-                print(f"[ERROR] Failed to create fresh database: {str(e2)}")
+                logger.error("Failed to create fresh database: %s", e2)
                 raise
     
     def _create_fresh_tables(self, cursor):
         """Create fresh database tables with all columns"""
-        print("[DEBUG] Creating emails table...")
+        logger.debug("Creating emails table...")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS emails (
                 id TEXT PRIMARY KEY,
@@ -71,6 +252,7 @@ class EmailDatabase:
                 subject TEXT NOT NULL,
                 body TEXT DEFAULT '',
                 timestamp TEXT NOT NULL,
+                timestamp_unix INTEGER,
                 summary TEXT DEFAULT '',
                 has_reply BOOLEAN DEFAULT FALSE,
                 draft_reply TEXT DEFAULT '',
@@ -81,7 +263,7 @@ class EmailDatabase:
             )
         ''')
         
-        print("[DEBUG] Creating sync_metadata table...")
+        logger.debug("Creating sync_metadata table...")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sync_metadata (
                 key TEXT PRIMARY KEY,
@@ -91,7 +273,8 @@ class EmailDatabase:
         ''')
         
         self._create_indexes(cursor)
-        print("[DEBUG] Tables and indexes created successfully")
+        self._create_search_index(cursor)
+        logger.debug("Tables and indexes created successfully")
     
     def _migrate_database(self, cursor):
         """Migrate existing database to new schema"""
@@ -101,25 +284,51 @@ class EmailDatabase:
             columns = [column[1] for column in cursor.fetchall()]
             
             if 'priority' not in columns:
-                print("[MIGRATION] Adding priority column to emails table")
+                logger.info("Adding priority column to emails table")
                 cursor.execute('ALTER TABLE emails ADD COLUMN priority TEXT DEFAULT "medium"')
             
             if 'sender_name' not in columns:
-                print("[MIGRATION] Adding sender_name column to emails table")
+                logger.info("Adding sender_name column to emails table")
                 cursor.execute('ALTER TABLE emails ADD COLUMN sender_name TEXT DEFAULT ""')
             
             if 'conversation_id' not in columns:
-                print("[MIGRATION] Adding conversation_id column to emails table")
+                logger.info("Adding conversation_id column to emails table")
                 cursor.execute('ALTER TABLE emails ADD COLUMN conversation_id TEXT DEFAULT ""')
             
+            if 'timestamp_unix' not in columns:
+                logger.info("Adding timestamp_unix column to emails table")
+                cursor.execute('ALTER TABLE emails ADD COLUMN timestamp_unix INTEGER')
+                cursor.execute('''
+                    UPDATE emails SET timestamp_unix = CAST(strftime('%s', timestamp) AS INTEGER)
+                    WHERE timestamp_unix IS NULL
+                ''')
+            
+            # Older builds fired the search-index trigger on every update; recreated below
+            cursor.execute("DROP TRIGGER IF EXISTS emails_fts_au")
+            
             # Create any missing indexes
             self._create_indexes(cursor)
-            print("[DEBUG] Database migration completed")
+            self._create_search_index(cursor)
+            logger.debug("Database migration completed")
             
         except Exception as e:
-            print(f"[ERROR] Database migration failed: {str(e)}")
+            logger.error("Database migration failed: %s", e)
             raise
     
+    def _create_search_index(self, cursor):
+        """Create the full-text search table and triggers, indexing existing emails on first creation"""
+        try:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='emails_fts'")
+            is_new = cursor.fetchone() is None
+            for sql in _CREATE_SEARCH_INDEX_SQL:
+                cursor.execute(sql)
+            if is_new:
+                logger.info("Building full-text search index")
+                cursor.execute("INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            logger.warning("Full-text search unavailable, using LIKE search: %s", e)
+            self._fts_enabled = False
+    
     def _create_indexes(self, cursor):
         """Create necessary indexes"""
         indexes = [
@@ -127,207 +336,191 @@ class EmailDatabase:
             "CREATE INDEX IF NOT EXISTS idx_emails_has_reply ON emails(has_reply)",
             "CREATE INDEX IF NOT EXISTS idx_emails_relevant ON emails(is_relevant)",
             "CREATE INDEX IF NOT EXISTS idx_emails_priority ON emails(priority)",
-            "CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails(sender)"
+            "CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails(sender)",
+            # Every list query filters on is_relevant and orders by timestamp; these serve the
+            # filter and the order from one index instead of a scan plus a temp B-tree sort
+            "CREATE INDEX IF NOT EXISTS idx_emails_rel_ts ON emails(is_relevant, timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_emails_rel_reply_ts ON emails(is_relevant, has_reply, timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_emails_rel_pri_ts ON emails(is_relevant, priority, timestamp DESC)",
+            # Time-window filters (cleanup, recent-email count) compare integers against this
+            "CREATE INDEX IF NOT EXISTS idx_emails_ts_unix ON emails(timestamp_unix DESC)"
         ]
         
         for index_sql in indexes:
             try:
                 cursor.execute(index_sql)
             except Exception as e:
-                print(f"[WARNING] Failed to create index: {str(e)}")
+                logger.warning("Failed to create index: %s", e)
+    
+    @staticmethod
+    def _email_row(email_data: Dict) -> tuple:
+        """Column values for _SAVE_EMAIL_SQL"""
+        return (
+            email_data['id'],
+            email_data['sender'],
+            email_data.get('sender_name', ''),
+            email_data['subject'],
+            email_data['body'],
+            email_data['timestamp'],
+            _unix_time(email_data['timestamp']),
+            email_data.get('summary', ''),
+            email_data.get('has_reply', False),
+            email_data.get('draft_reply', ''),
+            email_data.get('is_relevant', True),
+            email_data.get('conversation_id', ''),
+            email_data.get('priority', 'medium')
+        )
     
     def save_email(self, email_data: Dict) -> bool:
         """Save or update email in database"""
+        return self.save_emails_bulk([email_data])
+    
+    def save_emails_bulk(self, emails: List[Dict]) -> bool:
+        """Save or update several emails in one transaction"""
+        if not emails:
+            return True
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
+                conn.executemany(_SAVE_EMAIL_SQL, (self._email_row(email) for email in emails))
+            logger.debug("Successfully saved %s emails", len(emails))
+            return True
+        except Exception as e:
+            logger.exception("Error saving emails: %s", e)
+            return False
+    
+    def get_emails_by_ids(self, email_ids: List[str]) -> Dict[str, Dict]:
+        """Get the stored relevant emails among email_ids, keyed by ID, with one query"""
+        if not email_ids:
+            return {}
+        try:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    INSERT OR REPLACE INTO emails 
-                    (id, sender, sender_name, subject, body, timestamp, summary, 
-                     has_reply, draft_reply, is_relevant, conversation_id, priority)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    email_data['id'],
-                    email_data['sender'],
-                    email_data.get('sender_name', ''),
-                    email_data['subject'],
-                    email_data['body'],
-                    email_data['timestamp'],
-                    email_data.get('summary', ''),
-                    email_data.get('has_reply', False),
-                    email_data.get('draft_reply', ''),
-                    email_data.get('is_relevant', True),
-                    email_data.get('conversation_id', ''),
-                    email_data.get('priority', 'medium')
-                ))
+                placeholders = ','.join('?' * len(email_ids))
+                cursor.execute(_GET_EMAILS_BY_IDS_SQL.format(placeholders), email_ids)
                 
-                conn.commit()
-                print(f"[DEBUG] Successfully saved email: {email_data['subject'][:30]}...")
-                return True
+                return {row['id']: dict(row) for row in cursor.fetchall()}
         except Exception as e:
-            print(f"[ERROR] Error saving email: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+            logger.error("Error getting emails by ID: %s", e)
+        
+        return {}
     
     def get_email_by_id(self, email_id: str) -> Optional[Dict]:
         """Get email by ID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM emails WHERE id = ? AND is_relevant = TRUE
-                ''', (email_id,))
+                cursor.execute(_GET_EMAIL_SQL, (email_id,))
                 
                 row = cursor.fetchone()
                 if row:
                     return dict(row)
         except Exception as e:
-            print(f"[ERROR] Error getting email by ID: {str(e)}")
+            logger.error("Error getting email by ID: %s", e)
         
         return None
     
     def get_all_emails(self, limit: int = 50) -> List[Dict]:
         """Get all relevant emails ordered by timestamp"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM emails 
-                    WHERE is_relevant = TRUE
-                    ORDER BY timestamp DESC 
-                    LIMIT ?
-                ''', (limit,))
+                cursor.execute(_GET_ALL_EMAILS_SQL, (limit,))
                 
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
         except Exception as e:
-            print(f"[ERROR] Error getting all emails: {str(e)}")
+            logger.error("Error getting all emails: %s", e)
+            return []
+    
+    def get_all_emails_summary(self, limit: int = 50) -> List[Dict]:
+        """Get all relevant emails ordered by timestamp, with a body excerpt instead of the body"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(_GET_ALL_EMAILS_SUMMARY_SQL, (limit,))
+                
+                rows = cursor.fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error("Error getting email summaries: %s", e)
             return []
     
     def get_emails_by_priority(self, priority: str) -> List[Dict]:
         """Get emails filtered by priority"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM emails 
-                    WHERE is_relevant = TRUE AND priority = ?
-                    ORDER BY timestamp DESC
-                ''', (priority.lower(),))
+                cursor.execute(_GET_EMAILS_BY_PRIORITY_SQL, (priority.lower(),))
                 
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
         except Exception as e:
-            print(f"[ERROR] Error getting emails by priority: {str(e)}")
+            logger.error("Error getting emails by priority: %s", e)
             return []
     
     def get_unreplied_emails(self) -> List[Dict]:
         """Get emails that haven't been replied to"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM emails 
-                    WHERE has_reply = FALSE AND is_relevant = TRUE
-                    ORDER BY timestamp DESC
-                ''')
+                cursor.execute(_GET_UNREPLIED_EMAILS_SQL)
                 
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
         except Exception as e:
-            print(f"[ERROR] Error getting unreplied emails: {str(e)}")
+            logger.error("Error getting unreplied emails: %s", e)
             return []
     
     def mark_as_replied(self, email_id: str) -> bool:
         """Mark email as replied"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    UPDATE emails 
-                    SET has_reply = TRUE 
-                    WHERE id = ?
-                ''', (email_id,))
+                cursor.execute(_MARK_REPLIED_SQL, (email_id,))
                 
                 conn.commit()
                 return cursor.rowcount > 0
         except Exception as e:
-            print(f"[ERROR] Error marking email as replied: {str(e)}")
+            logger.error("Error marking email as replied: %s", e)
             return False
     
     def update_draft_reply(self, email_id: str, draft_reply: str) -> bool:
         """Update draft reply for an email"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    UPDATE emails 
-                    SET draft_reply = ? 
-                    WHERE id = ?
-                ''', (draft_reply, email_id))
+                cursor.execute(_UPDATE_DRAFT_REPLY_SQL, (draft_reply, email_id))
                 
                 conn.commit()
                 return cursor.rowcount > 0
         except Exception as e:
-            print(f"[ERROR] Error updating draft reply: {str(e)}")
+            logger.error("Error updating draft reply: %s", e)
             return False
     
     def get_email_stats(self) -> Dict:
         """Get email statistics"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                # Total emails
-                cursor.execute('SELECT COUNT(*) FROM emails WHERE is_relevant = TRUE')
-                total_emails = cursor.fetchone()[0]
-                
-                # Unreplied emails
-                cursor.execute('SELECT COUNT(*) FROM emails WHERE has_reply = FALSE AND is_relevant = TRUE')
-                unreplied_emails = cursor.fetchone()[0]
-                
-                # Replied emails
-                cursor.execute('SELECT COUNT(*) FROM emails WHERE has_reply = TRUE AND is_relevant = TRUE')
-                replied_emails = cursor.fetchone()[0]
-                
-                # Recent emails (last 24 hours)
-                cursor.execute('''
-                    SELECT COUNT(*) FROM emails 
-                    WHERE datetime(timestamp) > datetime('now', '-1 day') 
-                    AND is_relevant = TRUE
-                ''')
-                recent_emails = cursor.fetchone()[0]
+                # Total, unreplied, replied and recent (last 24 hours) emails
+                cursor.execute(_EMAIL_COUNTS_SQL)
+                total_emails, unreplied_emails, replied_emails, recent_emails = cursor.fetchone()
                 
                 # Priority breakdown
-                cursor.execute('''
-                    SELECT priority, COUNT(*) as count 
-                    FROM emails 
-                    WHERE is_relevant = TRUE
-                    GROUP BY priority
-                ''')
+                cursor.execute(_PRIORITY_BREAKDOWN_SQL)
                 priority_stats = {row[0]: row[1] for row in cursor.fetchall()}
                 
                 # Top senders
-                cursor.execute('''
-                    SELECT sender, COUNT(*) as count 
-                    FROM emails 
-                    WHERE is_relevant = TRUE
-                    GROUP BY sender 
-                    ORDER BY count DESC 
-                    LIMIT 5
-                ''')
+                cursor.execute(_TOP_SENDERS_SQL)
                 top_senders = [{'sender': row[0], 'count': row[1]} for row in cursor.fetchall()]
                 
                 return {
@@ -340,7 +533,7 @@ class EmailDatabase:
                     'top_senders': top_senders
                 }
         except Exception as e:
-            print(f"[ERROR] Error getting email stats: {str(e)}")
+            logger.error("Error getting email stats: %s", e)
             return {
                 'total_emails': 0,
                 'unreplied_emails': 0,
@@ -354,69 +547,88 @@ class EmailDatabase:
     def update_last_sync(self):
         """Update last sync timestamp"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
-                    VALUES ('last_sync', ?, CURRENT_TIMESTAMP)
-                ''', (datetime.now().isoformat(),))
+                last_sync = datetime.now().isoformat()
+                cursor.execute(_SET_LAST_SYNC_SQL, (last_sync,))
                 
                 conn.commit()
+                self._last_sync, self._last_sync_loaded = last_sync, True
         except Exception as e:
-            print(f"[ERROR] Error updating last sync: {str(e)}")
+            logger.error("Error updating last sync: %s", e)
     
     def get_last_sync_time(self) -> Optional[str]:
         """Get last sync timestamp"""
+        if self._last_sync_loaded:
+            return self._last_sync
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT value FROM sync_metadata WHERE key = 'last_sync'
-                ''')
+                cursor.execute(_GET_LAST_SYNC_SQL)
                 
+                result = cursor.fetchone()
+                self._last_sync = result[0] if result else None
+                self._last_sync_loaded = True
+                return self._last_sync
+        except Exception as e:
+            logger.error("Error getting last sync time: %s", e)
+            return None
+    
+    def get_sync_value(self, key: str) -> Optional[str]:
+        """Get a value from sync_metadata"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_GET_SYNC_VALUE_SQL, (key,))
                 result = cursor.fetchone()
                 return result[0] if result else None
         except Exception as e:
-            print(f"[ERROR] Error getting last sync time: {str(e)}")
+            logger.error("Error getting sync value %s: %s", key, e)
             return None
     
+    def set_sync_value(self, key: str, value: str):
+        """Store a value in sync_metadata"""
+        try:
+            with self._connect() as conn:
+                conn.execute(_SET_SYNC_VALUE_SQL, (key, value))
+                conn.commit()
+        except Exception as e:
+            logger.error("Error setting sync value %s: %s", key, e)
+    
     def search_emails(self, query: str, limit: int = 20) -> List[Dict]:
         """Search emails by subject, sender, or body content"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                search_pattern = f"%{query}%"
-                cursor.execute('''
-                    SELECT * FROM emails 
-                    WHERE (subject LIKE ? OR sender LIKE ? OR body LIKE ?)
-                    AND is_relevant = TRUE
-                    ORDER BY timestamp DESC 
-                    LIMIT ?
-                ''', (search_pattern, search_pattern, search_pattern, limit))
+                if self._fts_enabled:
+                    # Each word of the query as a quoted prefix term, so user input can't break MATCH syntax
+                    terms = ' '.join(f'"{token}"*' for token in _SEARCH_TOKEN_RE.findall(query))
+                    if not terms:
+                        return []
+                    cursor.execute(_SEARCH_EMAILS_FTS_SQL, (terms, limit))
+                else:
+                    search_pattern = f"%{query}%"
+                    cursor.execute(_SEARCH_EMAILS_SQL, (search_pattern, search_pattern, search_pattern, limit))
                 
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
         except Exception as e:
-            print(f"[ERROR] Error searching emails: {str(e)}")
+            logger.error("Error searching emails: %s", e)
             return []
     
     def cleanup_old_emails(self, days: int = 30):
         """Remove emails older than specified days"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    DELETE FROM emails 
-                    WHERE datetime(timestamp) < datetime('now', '-{} days')
-                '''.format(days))
+                cursor.execute(_CLEANUP_OLD_EMAILS_SQL, (f'-{int(days)} days',))
                 
                 conn.commit()
                 return cursor.rowcount
         except Exception as e:
-            print(f"[ERROR] Error cleaning up old emails: {str(e)}")
+            logger.error("Error cleaning up old emails: %s", e)
             return 0
\ No newline at end of file
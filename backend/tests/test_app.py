@@ -0,0 +1,54 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """Fresh import of app.py with push notifications enabled and its database in a temp dir"""
+    monkeypatch.setenv('FLASK_SECRET_KEY', 'test-secret')
+    monkeypatch.setenv('OUTLOOK_CLIENT_ID', 'client-id')
+    monkeypatch.setenv('OUTLOOK_CLIENT_SECRET', 'client-secret')
+    monkeypatch.setenv('REDIRECT_URI', 'http://localhost:5000/auth/callback')
+    monkeypatch.setenv('FRONTEND_URL', 'http://localhost:3000')
+    monkeypatch.setenv('GRAPH_NOTIFICATION_URL', 'https://example.test/webhooks/graph/notifications')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(BACKEND_DIR)
+    sys.modules.pop('app', None)
+    yield importlib.import_module('app')
+    sys.modules.pop('app', None)
+
+def test_logout_then_login_creates_new_subscription(app_module, monkeypatch):
+    created, deleted = [], []
+
+    def create_subscription(access_token, notification_url, client_state, lifetime):
+        created.append((access_token, client_state))
+        return {'id': f"subscription-{len(created)}"}
+
+    def delete_subscription(access_token, subscription_id):
+        deleted.append((access_token, subscription_id))
+        return True
+
+    monkeypatch.setattr(app_module.email_service, 'create_subscription', create_subscription)
+    monkeypatch.setattr(app_module.email_service, 'delete_subscription', delete_subscription)
+
+    # First user: subscribed once, and the live subscription is reused while it is fresh
+    app_module.active_tokens.set({'access_token': 'token-a'})
+    assert app_module.ensure_mail_subscription('token-a')
+    assert app_module.ensure_mail_subscription('token-a')
+    assert [token for token, _ in created] == ['token-a']
+
+    response = app_module.app.test_client().post('/api/logout')
+    assert response.status_code == 200
+    assert deleted == [('token-a', 'subscription-1')]
+    assert 'id' not in app_module.mail_subscription
+
+    # Second user gets a subscription of their own, and the old one's notifications no longer match
+    app_module.active_tokens.set({'access_token': 'token-b'})
+    assert app_module.ensure_mail_subscription('token-b')
+    assert [token for token, _ in created] == ['token-a', 'token-b']
+    assert created[0][1] != created[1][1]
+    assert app_module.mail_subscription['id'] == 'subscription-2'
@@ -0,0 +1,14 @@
+"""Production entry point.
+
+Run with a single worker process and several threads:
+
+    gunicorn wsgi:app -k gthread -w 1 --threads 8 --timeout 120 --keep-alive 5
+
+Tokens, the mail subscription and the response caches live in process memory,
+so extra worker processes would each run their own background checker and miss
+each other's logins; scale with --threads instead.
+"""
+from app import app, configure_logging, start_background_tasks
+
+configure_logging()
+start_background_tasks()
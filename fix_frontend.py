@@ -7,78 +7,68 @@ import os
 import shutil
 from pathlib import Path
 
+# Resolved once so the helpers work from any cwd without chdir round-trips
+_FRONTEND = Path(__file__).resolve().parent / 'frontend'
+_SRC_DIR = _FRONTEND / 'src'
+_COMPONENTS_DIR = _SRC_DIR / 'components'
+_SERVICES_DIR = _SRC_DIR / 'services'
+_STYLES_DIR = _SRC_DIR / 'styles'
+
+# Placeholder files per directory; the keys are also the directories to create
+_PLACEHOLDER_FILES = {
+    _COMPONENTS_DIR: ('Dashboard.js', 'EmailCard.js', 'EmailModal.js', 'Sidebar.js'),
+    _SERVICES_DIR: ('api.js',),
+    _STYLES_DIR: ('globals.css',)
+}
+
 def fix_frontend_structure():
     """Fix frontend file structure and naming issues"""
     
-    frontend_dir = Path('./frontend')
-    if not frontend_dir.exists():
+    if not _FRONTEND.exists():
         print("❌ Frontend directory not found!")
         return False
     
-    os.chdir('frontend')
-    
-    # Create necessary directories
-    directories = [
-        'src/components',
-        'src/services', 
-        'src/styles'
-    ]
+    # Create necessary directories; Path.mkdir tries mkdir first and only
+    # walks up to src/ when it is missing, so the shared parent isn't re-stat'd
+    for dir_path in _PLACEHOLDER_FILES:
+        dir_path.mkdir(parents=True, exist_ok=True)
+        print(f"✅ Created directory: src/{dir_path.name}")
     
-    for dir_path in directories:
-        Path(dir_path).mkdir(parents=True, exist_ok=True)
-        print(f"✅ Created directory: {dir_path}")
-    
-    # Check for case-sensitive file issues
-    styles_dir = Path('src/styles')
-    if styles_dir.exists():
-        # Check if there's a "Styles" directory (capital S)
-        parent_dir = styles_dir.parent
-        for item in parent_dir.iterdir():
-            if item.is_dir() and item.name.lower() == 'styles' and item.name != 'styles':
-                print(f"🔄 Found case mismatch: {item.name} -> styles")
+    # Check for case-sensitive file issues: a "Styles" directory (capital S)
+    parent_dir = _SRC_DIR
+    # is_dir() comes from the directory entry, so no stat per item
+    with os.scandir(parent_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name != 'styles' and name.lower() == 'styles' and entry.is_dir(follow_symlinks=False):
+                print(f"🔄 Found case mismatch: {name} -> styles")
                 # Rename to correct case
-                temp_name = item.name + '_temp'
-                item.rename(parent_dir / temp_name)
-                (parent_dir / temp_name).rename(parent_dir / 'styles')
+                temp_path = parent_dir / (name + '_temp')
+                os.rename(entry.path, temp_path)
+                temp_path.rename(parent_dir / 'styles')
                 break
     
-    # Create empty component files if they don't exist
-    component_files = [
-        'src/components/Dashboard.js',
-        'src/components/EmailCard.js', 
-        'src/components/EmailModal.js',
-        'src/components/Sidebar.js'
-    ]
-    
-    for comp_file in component_files:
-        comp_path = Path(comp_file)
-        if not comp_path.exists():
-            comp_path.touch()
-            print(f"📄 Created empty file: {comp_file}")
-    
-    # Create empty service and style files
-    other_files = [
-        'src/services/api.js',
-        'src/styles/globals.css'
-    ]
-    
-    for file_path in other_files:
-        file_obj = Path(file_path)
-        if not file_obj.exists():
-            file_obj.touch()
+    # Create empty placeholder files if they don't exist
+    for dir_path, file_names in _PLACEHOLDER_FILES.items():
+        # One directory listing instead of an exists() stat per file
+        with os.scandir(dir_path) as entries:
+            existing = {entry.name for entry in entries}
+        
+        for file_name in file_names:
+            if file_name in existing:
+                continue
+            file_path = f"src/{dir_path.name}/{file_name}"
+            try:
+                os.close(os.open(dir_path.joinpath(file_name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError:
+                continue
             print(f"📄 Created empty file: {file_path}")
     
-    os.chdir('..')
     print("✅ Frontend structure fixed!")
     return True
 
-def create_minimal_components():
-    """Create minimal working components to prevent import errors"""
-    
-    os.chdir('frontend')
-    
-    # Minimal Dashboard component
-    dashboard_content = '''import React from 'react';
+# Minimal Dashboard component
+_DASHBOARD_JS = '''import React from 'react';
 
 const Dashboard = ({ emails, loading, authenticated, onEmailSelect, onRefresh }) => {
   if (!authenticated) {
@@ -113,14 +103,10 @@ const Dashboard = ({ emails, loading, authenticated, onEmailSelect, onRefresh })
   );
 };
 
-export default Dashboard;'''
+export default Dashboard;'''.encode('utf-8')
 
-    # Write minimal components with UTF-8 encoding
-    with open('src/components/Dashboard.js', 'w', encoding='utf-8') as f:
-        f.write(dashboard_content)
-    
-    # Minimal EmailCard
-    emailcard_content = '''import React from 'react';
+# Minimal EmailCard
+_EMAIL_CARD_JS = '''import React from 'react';
 
 const EmailCard = ({ email, onClick, view = 'grid' }) => {
   return (
@@ -140,13 +126,10 @@ const EmailCard = ({ email, onClick, view = 'grid' }) => {
   );
 };
 
-export default EmailCard;'''
+export default EmailCard;'''.encode('utf-8')
 
-    with open('src/components/EmailCard.js', 'w', encoding='utf-8') as f:
-        f.write(emailcard_content)
-    
-    # Minimal EmailModal (using X instead of Unicode)
-    emailmodal_content = '''import React from 'react';
+# Minimal EmailModal (using X instead of Unicode)
+_EMAIL_MODAL_JS = '''import React from 'react';
 
 const EmailModal = ({ email, onClose, onUpdate }) => {
   if (!email) return null;
@@ -185,13 +168,10 @@ const EmailModal = ({ email, onClose, onUpdate }) => {
   );
 };
 
-export default EmailModal;'''
+export default EmailModal;'''.encode('utf-8')
 
-    with open('src/components/EmailModal.js', 'w', encoding='utf-8') as f:
-        f.write(emailmodal_content)
-    
-    # Minimal Sidebar (fixed syntax)
-    sidebar_content = '''import React from 'react';
+# Minimal Sidebar (fixed syntax)
+_SIDEBAR_JS = '''import React from 'react';
 
 const Sidebar = ({ 
   collapsed, 
@@ -284,13 +264,10 @@ const Sidebar = ({
   );
 };
 
-export default Sidebar;'''
+export default Sidebar;'''.encode('utf-8')
 
-    with open('src/components/Sidebar.js', 'w', encoding='utf-8') as f:
-        f.write(sidebar_content)
-    
-    # Minimal API service
-    api_content = '''import axios from 'axios';
+# Minimal API service
+_API_JS = '''import axios from 'axios';
 
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
@@ -359,13 +336,10 @@ export const getEmailPriority = (email) => {
   return 'normal';
 };
 
-export default api;'''
+export default api;'''.encode('utf-8')
 
-    with open('src/services/api.js', 'w', encoding='utf-8') as f:
-        f.write(api_content)
-    
-    # Basic CSS
-    css_content = '''@tailwind base;
+# Basic CSS
+_GLOBALS_CSS = '''@tailwind base;
 @tailwind components;
 @tailwind utilities;
 
@@ -388,12 +362,25 @@ export default api;'''
   -webkit-line-clamp: 6;
   -webkit-box-orient: vertical;
   overflow: hidden;
-}'''
+}'''.encode('utf-8')
+
+# Files written by create_minimal_components; six small page-cache writes
+# finish faster serially than through a thread pool
+_MINIMAL_COMPONENTS = (
+    (_COMPONENTS_DIR.joinpath('Dashboard.js'), _DASHBOARD_JS),
+    (_COMPONENTS_DIR.joinpath('EmailCard.js'), _EMAIL_CARD_JS),
+    (_COMPONENTS_DIR.joinpath('EmailModal.js'), _EMAIL_MODAL_JS),
+    (_COMPONENTS_DIR.joinpath('Sidebar.js'), _SIDEBAR_JS),
+    (_SERVICES_DIR.joinpath('api.js'), _API_JS),
+    (_STYLES_DIR.joinpath('globals.css'), _GLOBALS_CSS)
+)
 
-    with open('src/styles/globals.css', 'w', encoding='utf-8') as f:
-        f.write(css_content)
+def create_minimal_components():
+    """Create minimal working components to prevent import errors"""
+    
+    for path, content in _MINIMAL_COMPONENTS:
+        path.write_bytes(content)
     
-    os.chdir('..')
     print("✅ Created minimal components!")
 
 if __name__ == "__main__":
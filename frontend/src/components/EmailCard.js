@@ -13,7 +13,7 @@ const EmailCard = ({ email, onClick, view = 'grid' }) => {
         </span>
       </div>
       <p className="text-sm font-medium mb-2 truncate">{email?.subject || 'No Subject'}</p>
-      <p className="text-sm text-gray-600 line-clamp-2">{email?.summary || email?.body || 'No content'}</p>
+      <p className="text-sm text-gray-600 line-clamp-2">{email?.summary || email?.preview || 'No content'}</p>
     </div>
   );
 };
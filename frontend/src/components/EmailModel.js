@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { toast } from 'react-toastify';
-import { getEmailDetails, sendReply, regenerateReply } from '../services/api';
+import { getEmailDetails, sendReply, regenerateReply, streamRegeneratedReply } from '../services/api';
 import { formatTimestamp, getSenderInitials, getAvatarColor } from '../services/api';
 
 const EmailModal = ({ email, onClose, onUpdate }) => {
@@ -63,8 +63,15 @@ const EmailModal = ({ email, onClose, onUpdate }) => {
   const handleRegenerateReply = async () => {
     try {
       setRegenerating(true);
-      const response = await regenerateReply(email.id);
-      setReplyContent(response.draft_reply);
+      let draftReply;
+      try {
+        // Show the reply as it is written; browsers without stream support use the plain request
+        draftReply = await streamRegeneratedReply(email.id, setReplyContent);
+      } catch (streamError) {
+        console.error('Reply stream failed, retrying without streaming:', streamError);
+        draftReply = (await regenerateReply(email.id)).draft_reply;
+      }
+      setReplyContent(draftReply);
       toast.success('New reply generated!');
     } catch (error) {
       console.error('Error regenerating reply:', error);
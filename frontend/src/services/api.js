@@ -41,6 +41,39 @@ export const regenerateReply = async (emailId) => {
   return response.data;
 };
 
+// Streams a new draft: onText gets the text so far as it arrives, the result is the saved draft
+export const streamRegeneratedReply = async (emailId, onText) => {
+  const response = await fetch(`${API_BASE_URL}/api/emails/${emailId}/regenerate-reply/stream`, {
+    method: 'POST',
+    credentials: 'include',
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Request failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  let text = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+
+    // Events end with a blank line; keep a partial event for the next read
+    const events = buffered.split('\n\n');
+    buffered = events.pop();
+    for (const event of events) {
+      if (!event.startsWith('data: ')) continue;
+      const data = JSON.parse(event.slice(6));
+      if (data.done) return data.draft_reply;
+      text += data.text;
+      onText(text);
+    }
+  }
+  throw new Error('Reply stream ended early');
+};
+
 export const initiateAuth = async () => {
   const response = await api.get('/auth/login');
   window.location.href = response.data.auth_url;
@@ -3,12 +3,40 @@ Smart Email Assistant Setup Script
 Automated setup and validation for the email assistant application
 """
 
+import functools
 import os
+import re
 import sys
 import subprocess
 import platform
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+_IS_WINDOWS = platform.system() == 'Windows'
+
+# `node --version` prints e.g. b'v18.17.1\n'
+_NODE_VERSION_RE = re.compile(rb'\s*v?((\d+)[\d.]*)')
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path) -> Path:
+    """Create a directory (and its parents) once per run; repeat calls are a cache lookup"""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+# requests may not be installed yet when the setup script first runs
+try:
+    import requests
+except ImportError:
+    requests = None
+
+# Local service, so one pooled connection and a short timeout are enough
+_OLLAMA_TAGS_URL = 'http://localhost:11434/api/tags'
+_OLLAMA_SESSION = None
+if requests is not None:
+    _OLLAMA_SESSION = requests.Session()
+    _OLLAMA_SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
 def check_python_version():
     """Check if Python version is 3.8 or higher"""
     version = sys.version_info
@@ -22,10 +50,11 @@ def check_python_version():
 def check_node_version():
     """Check if Node.js is installed and version is 16+"""
     try:
-        result = subprocess.run(['node', '--version'], capture_output=True, text=True)
+        result = subprocess.run(['node', '--version'], capture_output=True)
         if result.returncode == 0:
-            version = result.stdout.strip().replace('v', '')
-            major_version = int(version.split('.')[0])
+            match = _NODE_VERSION_RE.match(result.stdout)
+            version = match.group(1).decode('ascii') if match else result.stdout.strip().decode(errors='replace')
+            major_version = int(match.group(2)) if match else 0
             if major_version >= 16:
                 print(f"✅ Node.js {version} - OK")
                 return True
@@ -38,12 +67,15 @@ def check_node_version():
 
 def check_ollama():
     """Check if Ollama is installed and running"""
+    if _OLLAMA_SESSION is None:
+        print("❌ Cannot check Ollama: the requests package is not installed")
+        return False
+    
     try:
-        import requests
-        response = requests.get('http://localhost:11434/api/tags', timeout=5)
+        response = _OLLAMA_SESSION.get(_OLLAMA_TAGS_URL, timeout=2)
         if response.status_code == 200:
             models = response.json().get('models', [])
-            phi3_found = any('phi3' in model['name'] for model in models)
+            phi3_found = 'phi3' in '\n'.join(model['name'] for model in models)
             if phi3_found:
                 print("✅ Ollama running with phi3 model - OK")
                 return True
@@ -74,13 +106,15 @@ def check_env_file():
         'FRONTEND_URL'
     ]
     
-    with open(env_path, 'r') as f:
-        content = f.read()
+    # Stream the file once as bytes (no decode), then look each variable up
+    env_values = {}
+    with open(env_path, 'rb') as f:
+        for line in f:
+            key, sep, value = line.partition(b'=')
+            if sep and not key.lstrip().startswith(b'#'):
+                env_values[key.strip()] = value.strip().strip(b'"\'')
     
-    missing_vars = []
-    for var in required_vars:
-        if f"{var}=" not in content or f"{var}=" in content and not content.split(f"{var}=")[1].split('\n')[0].strip():
-            missing_vars.append(var)
+    missing_vars = [var for var in required_vars if not env_values.get(var.encode())]
     
     if missing_vars:
         print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
@@ -95,7 +129,7 @@ def setup_backend():
     
     backend_dir = Path('backend')
     if not backend_dir.exists():
-        backend_dir.mkdir()
+        _ensure_dir(backend_dir)
         print("📁 Created backend directory")
     
     # Create virtual environment
@@ -105,7 +139,7 @@ def setup_backend():
         subprocess.run([sys.executable, '-m', 'venv', str(venv_dir)])
     
     # Determine activation script based on OS
-    if platform.system() == 'Windows':
+    if _IS_WINDOWS:
         pip_path = venv_dir / 'Scripts' / 'pip'
         python_path = venv_dir / 'Scripts' / 'python'
     else:
@@ -121,17 +155,20 @@ def setup_backend():
     ]
     
     print("📦 Installing Python dependencies...")
-    for dep in dependencies:
-        result = subprocess.run([str(pip_path), 'install', dep], 
-                              capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to install {dep}")
-            print(result.stderr)
-            return False
+    # One pip run resolves and downloads everything together
+    result = subprocess.run([str(pip_path), 'install', '--no-input', *dependencies], 
+                          capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ Failed to install {', '.join(dependencies)}")
+        print(result.stderr)
+        return False
     
     print("✅ Backend setup complete")
     return True
 
+# Same layout fix_frontend.py creates under frontend/src
+_FRONTEND_SRC_DIRS = ('components', 'services', 'styles')
+
 def setup_frontend():
     """Setup React frontend if it doesn't exist"""
     print("\n⚛️ Checking React frontend...")
@@ -147,8 +184,6 @@ def setup_frontend():
             return False
     
     # Install additional dependencies
-    os.chdir('frontend')
-    
     additional_deps = [
         'axios',
         'react-router-dom', 
@@ -171,60 +206,71 @@ def setup_frontend():
     print("📦 Installing React dependencies...")
     
     # Install regular dependencies
-    result = subprocess.run(['npm', 'install'] + additional_deps,
+    result = subprocess.run(['npm', 'install'] + additional_deps, cwd=frontend_dir,
                           capture_output=True, text=True)
     if result.returncode != 0:
         print("❌ Failed to install React dependencies")
         print(result.stderr)
-        os.chdir('..')
         return False
     
     # Install dev dependencies
-    result = subprocess.run(['npm', 'install', '-D'] + dev_deps,
+    result = subprocess.run(['npm', 'install', '-D'] + dev_deps, cwd=frontend_dir,
                           capture_output=True, text=True)
     if result.returncode != 0:
         print("❌ Failed to install dev dependencies")
         print(result.stderr)
-        os.chdir('..')
         return False
     
     # Initialize Tailwind
-    result = subprocess.run(['npx', 'tailwindcss', 'init', '-p'],
+    result = subprocess.run(['npx', 'tailwindcss', 'init', '-p'], cwd=frontend_dir,
                           capture_output=True, text=True)
     
     # Create necessary directories
-    Path('src/components').mkdir(exist_ok=True)
-    Path('src/services').mkdir(exist_ok=True)
-    Path('src/styles').mkdir(exist_ok=True)
+    src_dir = frontend_dir / 'src'
+    for dir_name in _FRONTEND_SRC_DIRS:
+        _ensure_dir(src_dir / dir_name)
     
-    os.chdir('..')
     print("✅ Frontend setup complete")
     return True
 
+# Files validate_file_structure expects, with a description for the report
+_REQUIRED_FILES = {
+    'backend/app.py': 'Main Flask application',
+    'backend/email_service.py': 'Email service integration',
+    'backend/ai_service.py': 'AI service integration',
+    'backend/models.py': 'Database models',
+    'backend/utils.py': 'Utility functions',
+    'frontend/src/App.js': 'Main React component',
+    'frontend/src/components/Dashboard.js': 'Dashboard component',
+    'frontend/src/components/EmailCard.js': 'Email card component',
+    'frontend/src/components/EmailModal.js': 'Email modal component',
+    'frontend/src/components/Sidebar.js': 'Sidebar component',
+    'frontend/src/services/api.js': 'API service',
+    'frontend/src/styles/globals.css': 'Global styles',
+    'frontend/tailwind.config.js': 'Tailwind configuration'
+}
+
 def validate_file_structure():
     """Validate that all necessary files are in place"""
     print("\n📁 Validating file structure...")
     
-    required_files = {
-        'backend/app.py': 'Main Flask application',
-        'backend/email_service.py': 'Email service integration',
-        'backend/ai_service.py': 'AI service integration',
-        'backend/models.py': 'Database models',
-        'backend/utils.py': 'Utility functions',
-        'frontend/src/App.js': 'Main React component',
-        'frontend/src/components/Dashboard.js': 'Dashboard component',
-        'frontend/src/components/EmailCard.js': 'Email card component',
-        'frontend/src/components/EmailModal.js': 'Email modal component',
-        'frontend/src/components/Sidebar.js': 'Sidebar component',
-        'frontend/src/services/api.js': 'API service',
-        'frontend/src/styles/globals.css': 'Global styles',
-        'frontend/tailwind.config.js': 'Tailwind configuration'
-    }
-    
-    missing_files = []
-    for file_path, description in required_files.items():
-        if not Path(file_path).exists():
-            missing_files.append(f"{file_path} ({description})")
+    # One directory listing per parent instead of a stat per file; is_file()
+    # reads the type from the directory entry (stat only for symlinks)
+    present = {}
+    for file_path in _REQUIRED_FILES:
+        parent = os.path.dirname(file_path)
+        if parent not in present:
+            try:
+                with os.scandir(parent) as entries:
+                    present[parent] = {entry.name for entry in entries if entry.is_file()}
+            except FileNotFoundError:
+                present[parent] = set()
+    
+    missing_files = [
+        f"{file_path} ({description})"
+        for file_path, description in _REQUIRED_FILES.items()
+        if os.path.basename(file_path) not in present[os.path.dirname(file_path)]
+    ]
     
     if missing_files:
         print("❌ Missing files:")
@@ -243,23 +289,22 @@ def main():
     
     # System checks
     print("\n🔍 System Requirements Check:")
-    checks = [
-        check_python_version(),
-        check_node_version(),
-        check_env_file()
-    ]
-    
-    if not all(checks):
+    # Cheapest first; stop at the first failure so node isn't spawned needlessly
+    if not (check_python_version() and check_env_file() and check_node_version()):
         print("\n❌ Please fix the above issues before continuing")
         return False
     
-    # Setup backend
-    if not setup_backend():
+    # Backend and frontend installs are independent and network-bound, so
+    # run them side by side; each keeps its own steps in order
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        backend_future = executor.submit(setup_backend)
+        frontend_future = executor.submit(setup_frontend)
+    
+    if not backend_future.result():
         print("\n❌ Backend setup failed")
         return False
     
-    # Setup frontend  
-    if not setup_frontend():
+    if not frontend_future.result():
         print("\n❌ Frontend setup failed")
         return False
     
@@ -278,7 +323,8 @@ def main():
     print("1. Ensure Ollama is running: ollama serve")
     if not ollama_ok:
         print("2. Pull AI model: ollama pull phi3:mini")
-    print(f"3. Start backend: cd backend && {'venv\\Scripts\\activate' if platform.system() == 'Windows' else 'source venv/bin/activate'} && python app.py")
+    activate_cmd = 'venv\\Scripts\\activate' if _IS_WINDOWS else 'source venv/bin/activate'
+    print(f"3. Start backend: cd backend && {activate_cmd} && python app.py")
     print("4. Start frontend: cd frontend && npm start")
     print("5. Open http://localhost:3000 in your browser")
     